@@ -0,0 +1,277 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from db import Database, create_schema
+from metrics import METRICS, Histogram
+from recorder import AttendanceRecorder
+
+# --- قياس الأداء بدون كاميرا أو واجهة ---
+# نفس الكود الذي يستخدمه run_camera وrun_verify، لكن من ملف فيديو أو إطارات صناعية،
+# مع معرض بصمات صناعي، وضغط على attendance/sessions من عدة أكشاك ولوحات في نفس الوقت
+# (كل كشك process مستقل باتصاله وكاتب الحضور الخاص به، مثل الأكشاك الحقيقية).
+# النتائج JSON فيها رقم النسخة (git) حتى تُقارن بين الإصدارات.
+#
+#   python bench.py all --out bench.json
+#   python bench.py vision --video lecture.mp4
+#   python bench.py match --sizes 1000 10000 100000
+#   python bench.py db --kiosks 8 --dashboards 4 --seconds 10
+
+SEED = 1234
+
+
+def _summary(h):
+    return {k: (v if k == "count" else round(float(v), 3)) for k, v in h.summary().items()}
+
+
+def _git_rev():
+    try: return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError): return None
+
+
+def environment():
+    env = {"at": datetime.now().isoformat(timespec="seconds"), "version": _git_rev(), "python": platform.python_version(),
+           "platform": platform.platform(), "cpu_count": os.cpu_count(), "numpy": np.__version__}
+    try:
+        import cv2
+        env["opencv"] = cv2.__version__
+    except ImportError: pass
+    return env
+
+
+# --- الرؤية ---
+def synthetic_video(path, frames=300, size=(640, 480), fps=30):
+    """فيديو صناعي: خلفية ثابتة مع شكل بيضاوي يتحرك ثم يثبت (مثل طالب يقف أمام الكشك)."""
+    import cv2
+    rng = np.random.default_rng(SEED)
+    w, h = size
+    bg = rng.integers(40, 90, (h, w, 3), dtype=np.uint8)
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, size)
+    for i in range(frames):
+        f = bg.copy()
+        if frames // 5 < i < frames - frames // 5:
+            x = int(w * 0.3 + min(i, frames // 2) * 0.5) % w
+            cv2.ellipse(f, (x, h // 2), (60, 80), 0, 0, 360, (150, 170, 200), -1)
+            cv2.circle(f, (x - 22, h // 2 - 15), 7, (40, 40, 40), -1); cv2.circle(f, (x + 22, h // 2 - 15), 7, (40, 40, 40), -1)
+        out.write(f)
+    out.release()
+    return path
+
+
+def read_frames(source, limit):
+    from pipeline import open_capture
+    cap = open_capture(source); frames = []
+    while len(frames) < limit:
+        ret, frame = cap.read()
+        if not ret: break
+        frames.append(np.ascontiguousarray(frame, dtype=np.uint8))
+    cap.release()
+    return frames
+
+
+def bench_vision(video=None, frames=300, stride=2):
+    from detection import FaceDetector, encode_faces
+    from pipeline import FacePipeline, VisionWorker
+    tmp = None
+    if video is None:
+        tmp = tempfile.TemporaryDirectory(); video = synthetic_video(os.path.join(tmp.name, "synthetic.avi"), frames)
+    result = {"source": "synthetic" if tmp else os.path.basename(video), "detect_stride": stride}
+
+    # 1) تسلسلي: خطوة VisionWorker نفسها إطاراً إطاراً بدون threads (زمن كل مرحلة)
+    data = read_frames(video, frames)
+    METRICS.reset(); METRICS.enabled = True
+    detector = FaceDetector(); worker = VisionWorker(None, detector, encode_faces, detect_stride=stride); per_frame = Histogram()
+    t0 = time.perf_counter()
+    for frame in data:
+        t = time.perf_counter()
+        worker.process(frame)
+        per_frame.add((time.perf_counter() - t) * 1000.0)
+    elapsed = time.perf_counter() - t0
+    result["sequential"] = {"frames": len(data), "fps": round(len(data) / elapsed, 1) if elapsed else None,
+                            "frame_ms": _summary(per_frame), "stages": METRICS.snapshot()["timers"], "detector": dict(detector.stats)}
+
+    # 2) خط المعالجة الكامل بسرعة الكاميرا: كم إطاراً سقط وكم تأخرت النتيجة
+    METRICS.reset()
+    shown = 0
+    pipe = FacePipeline(video, detect_stride=stride, pace=True)
+    t0 = time.perf_counter()
+    if pipe.start():
+        while pipe.running:
+            item, _ = pipe.next_frame()
+            if item is not None: shown += 1
+    pipe.stop()
+    elapsed = time.perf_counter() - t0
+    snap = METRICS.snapshot()
+    result["pipeline"] = {"displayed": shown, "display_fps": round(shown / elapsed, 1) if elapsed else None,
+                          "processed": pipe.worker.processed, "dropped": pipe.work_buf.dropped, "errors": pipe.worker.errors,
+                          "latency_ms": snap["timers"].get("vision.latency_ms"), "counters": snap["counters"]}
+    METRICS.enabled = False
+    if tmp: tmp.cleanup()
+    return result
+
+
+# --- المطابقة 1:N ---
+def synthetic_encodings(n, dim=128, rng=None):
+    # قيم البصمات الحقيقية قريبة من هذا التوزيع (|x| صغيرة، المسافة بين الأشخاص ~0.8-1.0)
+    rng = rng or np.random.default_rng(SEED)
+    return rng.normal(0.0, 0.07, (n, dim)).astype(np.float32)
+
+
+def bench_match(sizes=(1000, 10000, 100000), probes=500, k=5):
+    from gallery import FaceGallery
+    rng = np.random.default_rng(SEED); results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            enc = synthetic_encodings(n, rng=rng)
+            g = FaceGallery(capacity=n)
+            t = time.perf_counter()
+            for i in range(n): g.upsert(f"s{i}", enc[i])
+            build = time.perf_counter() - t
+            idx = rng.integers(0, n, probes)
+            queries = enc[idx] + rng.normal(0, 0.01, (probes, enc.shape[1])).astype(np.float32)
+            lat = Histogram(); hits = 0
+            t0 = time.perf_counter()
+            for sid, q in zip(idx, queries):
+                t = time.perf_counter()
+                top = g.identify(q, threshold=0.5, k=k)
+                lat.add((time.perf_counter() - t) * 1000.0)
+                hits += bool(top and top[0][0] == f"s{sid}")
+            elapsed = time.perf_counter() - t0
+            # ملف المعرض: زمن الحفظ وزمن الفتح بـ mmap (بدء تشغيل بدون قراءة كل صف)
+            path = os.path.join(tmp, f"gallery_{n}.npy")
+            t = time.perf_counter(); g.save(path); save = time.perf_counter() - t
+            g2 = FaceGallery(); t = time.perf_counter(); g2.load_file(path); mmap_load = time.perf_counter() - t
+            results[str(n)] = {"build_s": round(build, 3), "identify_ms": _summary(lat), "qps": round(probes / elapsed, 1),
+                               "top1_accuracy": round(hits / probes, 4), "cache_save_ms": round(save * 1000, 2), "cache_mmap_load_ms": round(mmap_load * 1000, 2)}
+            del g2
+    return results
+
+
+# --- قاعدة البيانات تحت الضغط ---
+def _kiosk(path, n, students, subs, today, mode, burst, ready, start, stop, results):
+    # process منفصل: كل كشك يتنافس على قفل الكتابة مثل برنامج main.py مستقل
+    db = Database(path); recorder = AttendanceRecorder(db) if mode == "recorder" else None
+    rng = random.Random(SEED + n); lat = Histogram()
+    counts = {"marks": 0, "new": 0, "errors": 0}
+    ready.put(n); start.wait()
+    # burst طلاب يقفون أمام نفس الكشك/الكاميرا في نفس اللحظة
+    while not stop.is_set():
+        marks = [(str(rng.randrange(students)), rng.choice(subs)) for _ in range(burst)]
+        t = time.perf_counter(); done = []
+        try:
+            if recorder:
+                futs = [recorder.mark(sid, sub, today) for sid, sub in marks]
+                for f in futs: done.append((f.result(), time.perf_counter()))
+            else:
+                for sid, sub in marks: done.append((db.mark_attendance(sid, sub, today), time.perf_counter()))
+        except Exception: counts["errors"] += 1; continue
+        for new, end in done: lat.add((end - t) * 1000.0); counts["marks"] += 1; counts["new"] += new
+    if recorder: recorder.close()
+    db.close()
+    results.put((counts, lat))
+
+
+def bench_db(kiosks=8, dashboards=4, seconds=10.0, students=3000, subjects=12, mode="recorder", burst=20):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        db = Database(path)
+        subs = [f"Subject {i}" for i in range(subjects)]
+        with db.transaction() as conn:
+            create_schema(conn)
+            conn.executemany("INSERT INTO students (student_id, name) VALUES (?, ?)", ((str(i), f"Student {i}") for i in range(students)))
+            conn.executemany("INSERT INTO sessions (subject_name, is_active) VALUES (?, 1)", ((s,) for s in subs))
+            # تاريخ حضور سابق حتى لا تكون الجداول فارغة (عدة فصول دراسية)
+            rng = random.Random(SEED)
+            conn.executemany("INSERT OR IGNORE INTO attendance VALUES (?, ?, ?, ?)",
+                             ((str(rng.randrange(students)), rng.choice(subs), d, d) for d in (f"2025-{m:02d}-{dd:02d}" for m in range(1, 13) for dd in range(1, 29)) for _ in range(300)))
+        today = datetime.now().strftime("%Y-%m-%d")
+        stop = threading.Event(); lock = threading.Lock()
+        write_lat = Histogram(); read_lat = Histogram(); toggle_lat = Histogram()
+        counts = {"marks": 0, "new": 0, "errors": 0, "reads": 0, "toggles": 0}
+
+        def dashboard(n):
+            from events import ChangeFeed, EventBus
+            feed = ChangeFeed(db, EventBus())
+            while not stop.is_set():
+                t = time.perf_counter()
+                try: db.dashboard_states(today); feed.poll()
+                except Exception:
+                    with lock: counts["errors"] += 1
+                    continue
+                ms = (time.perf_counter() - t) * 1000.0
+                with lock: read_lat.add(ms); counts["reads"] += 1
+                time.sleep(0.05)
+
+        def instructor():
+            rng = random.Random(SEED)
+            while not stop.is_set():
+                t = time.perf_counter()
+                try: db.toggle_session(rng.choice(subs))
+                except Exception:
+                    with lock: counts["errors"] += 1
+                    continue
+                with lock: toggle_lat.add((time.perf_counter() - t) * 1000.0); counts["toggles"] += 1
+                time.sleep(0.2)
+
+        ready, results = multiprocessing.Queue(), multiprocessing.Queue()
+        start, kiosk_stop = multiprocessing.Event(), multiprocessing.Event()
+        procs = [multiprocessing.Process(target=_kiosk, args=(path, i, students, subs, today, mode, burst, ready, start, kiosk_stop, results)) for i in range(kiosks)]
+        db.close()  # لا يرث أي كشك اتصال الـ process الأب
+        for p in procs: p.start()
+        for _ in procs: ready.get()
+        threads = [threading.Thread(target=dashboard, args=(i,)) for i in range(dashboards)] + [threading.Thread(target=instructor)]
+        t0 = time.perf_counter()
+        start.set()
+        for th in threads: th.start()
+        time.sleep(seconds); stop.set(); kiosk_stop.set()
+        elapsed = time.perf_counter() - t0
+        for _ in procs:
+            c, lat = results.get()
+            write_lat.merge(lat)
+            for k, v in c.items(): counts[k] += v
+        for p in procs: p.join()
+        for th in threads: th.join()
+        db.close()
+    return {"mode": mode, "kiosks": kiosks, "burst": burst, "dashboards": dashboards, "seconds": round(elapsed, 2),
+            "marks_per_s": round(counts["marks"] / elapsed, 1), **counts,
+            "mark_ms": _summary(write_lat), "dashboard_refresh_ms": _summary(read_lat), "toggle_ms": _summary(toggle_lat)}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline benchmarks (no camera or GUI needed)")
+    ap.add_argument("suite", choices=["vision", "match", "db", "all"])
+    ap.add_argument("--video", help="recorded video instead of synthetic frames")
+    ap.add_argument("--frames", type=int, default=300)
+    ap.add_argument("--stride", type=int, default=2)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    ap.add_argument("--probes", type=int, default=500)
+    ap.add_argument("--kiosks", type=int, default=8)
+    ap.add_argument("--burst", type=int, default=20, help="marks each kiosk submits at once")
+    ap.add_argument("--dashboards", type=int, default=4)
+    ap.add_argument("--seconds", type=float, default=10.0)
+    ap.add_argument("--mode", choices=["recorder", "direct"], default="recorder", help="attendance writes through the batching recorder or one transaction per mark")
+    ap.add_argument("--out", help="write results as JSON to this file")
+    args = ap.parse_args(argv)
+
+    report = {"env": environment()}
+    if args.suite in ("match", "all"): report["match"] = bench_match(args.sizes, args.probes)
+    if args.suite in ("db", "all"): report["db"] = bench_db(args.kiosks, args.dashboards, args.seconds, mode=args.mode, burst=args.burst)
+    if args.suite in ("vision", "all"): report["vision"] = bench_vision(args.video, args.frames, args.stride)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: f.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from events import TOPIC_ATTENDANCE, TOPIC_SESSION
+from metrics import METRICS
+
+# --- طبقة الوصول لقاعدة البيانات ---
+# اتصال دائم لكل thread (واجهة Tk وthread التحقق لا يتشاركان اتصالاً واحداً)،
+# مع WAL حتى لا تمنع القراءة الكتابة، وbusy timeout بدل خطأ "database is locked".
+# sqlite3 يحتفظ بالاستعلامات المجهزة لكل اتصال، فالاستعلامات المتكررة هنا لا تُعاد ترجمتها.
+
+BUSY_TIMEOUT = 5.0
+CHANGE_LOG_KEEP = 10000
+# يزيد مع كل تعديل على الجداول، وcreate_db لا تعمل إذا كانت القاعدة محدّثة
+SCHEMA_VERSION = 3
+# يميز تغييرات هذا البرنامج في change_log عن تغييرات البرامج الأخرى
+PROCESS_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+SQL_INSTRUCTOR_LOGIN = "SELECT 1 FROM instructors WHERE instructor_id=? AND secret_code=?"
+SQL_STUDENT_LOGIN = "SELECT is_face_registered FROM students WHERE student_id=? AND secret_code=?"
+SQL_SESSION_ACTIVE = "SELECT is_active FROM sessions WHERE subject_name=?"
+SQL_TOGGLE_SESSION = "UPDATE sessions SET is_active = 1 - is_active WHERE subject_name=?"
+SQL_ATTENDANCE_COUNT = "SELECT COUNT(*) FROM attendance WHERE subject_name=? AND date=?"
+SQL_GET_ENCODING = "SELECT face_encoding FROM students WHERE student_id=?"
+SQL_MARK_ATTENDANCE = "INSERT OR IGNORE INTO attendance (student_id, subject_name, timestamp, date) VALUES (?, ?, ?, ?)"
+SQL_LOG_CHANGE = "INSERT INTO change_log (topic, subject_name, origin) VALUES (?, ?, ?)"
+SQL_PRUNE_CHANGES = "DELETE FROM change_log WHERE seq <= (SELECT MAX(seq) FROM change_log) - ?"
+SQL_CHANGES_SINCE = "SELECT seq, topic, subject_name FROM change_log WHERE seq > ? AND origin != ? ORDER BY seq"
+# حالة كل المواد وعدد الحضور اليوم في استعلام واحد (يستخدم فهرس subject_name, date)
+SQL_DASHBOARD = """SELECT s.subject_name, s.is_active, COUNT(a.student_id) FROM sessions s
+                   LEFT JOIN attendance a ON a.subject_name = s.subject_name AND a.date = ?
+                   GROUP BY s.subject_name"""
+SQL_DASHBOARD_INSTRUCTOR = """SELECT s.subject_name, s.is_active, COUNT(a.student_id) FROM subject_instructors i
+                              JOIN sessions s ON s.subject_name = i.subject_name
+                              LEFT JOIN attendance a ON a.subject_name = s.subject_name AND a.date = ?
+                              WHERE i.instructor_id = ? GROUP BY s.subject_name"""
+SQL_SCHEDULE = "SELECT day, subject_name, start_time, room FROM schedule ORDER BY day_index, position"
+SQL_INSTRUCTOR_SCHEDULE = """SELECT c.day, c.subject_name, c.start_time, c.room FROM subject_instructors i
+                             JOIN schedule c ON c.subject_name = i.subject_name
+                             WHERE i.instructor_id = ? ORDER BY c.day_index, c.position"""
+SQL_DAY_ROOMS = "SELECT room, subject_name FROM schedule WHERE day=? ORDER BY position"
+# الحاضرون الآن بترتيب الوصول (rowid)
+SQL_ROSTER = """SELECT a.student_id, s.name FROM attendance a LEFT JOIN students s ON s.student_id = a.student_id
+                WHERE a.subject_name=? AND a.date=? ORDER BY a.rowid"""
+DAYS = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+
+
+class Database:
+    def __init__(self, path, timeout=BUSY_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns = []
+
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: الكتابة تتم داخل transaction() صراحة بـ BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+            self._local.conn = conn
+            with self._lock: self._conns.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        # IMMEDIATE يأخذ قفل الكتابة من البداية فيعمل busy timeout بدل فشل الترقية من قراءة لكتابة
+        conn = self.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try: yield conn
+        except BaseException: conn.execute("ROLLBACK"); raise
+        else: conn.execute("COMMIT")
+
+    def schema_version(self):
+        return self.conn().execute("PRAGMA user_version").fetchone()[0]
+
+    def set_schema_version(self, conn, version):
+        conn.execute(f"PRAGMA user_version={int(version)}")
+
+    def release(self):
+        """يغلق اتصال الـ thread الحالي. تستدعيه الـ threads قصيرة العمر قبل أن تنتهي."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None: return
+        self._local.conn = None
+        with self._lock:
+            if conn in self._conns: self._conns.remove(conn)
+        try: conn.close()
+        except sqlite3.Error: pass
+
+    def close(self):
+        with self._lock: conns, self._conns = self._conns, []
+        for conn in conns:
+            try: conn.close()
+            except sqlite3.Error: pass
+        self._local = threading.local()
+
+    # --- الاستعلامات المتكررة ---
+    @METRICS.timed("db.instructor_login")
+    def instructor_login(self, instructor_id, code):
+        return self.conn().execute(SQL_INSTRUCTOR_LOGIN, (instructor_id, code)).fetchone() is not None
+
+    @METRICS.timed("db.student_login")
+    def student_login(self, student_id, code):
+        """يرجع is_face_registered للطالب، أو None إذا كانت البيانات خاطئة."""
+        row = self.conn().execute(SQL_STUDENT_LOGIN, (student_id, code)).fetchone()
+        return row[0] if row else None
+
+    @METRICS.timed("db.session_active")
+    def session_active(self, subject):
+        row = self.conn().execute(SQL_SESSION_ACTIVE, (subject,)).fetchone()
+        return bool(row and row[0])
+
+    @METRICS.timed("db.toggle_session")
+    def toggle_session(self, subject):
+        with self.transaction() as conn:
+            conn.execute(SQL_TOGGLE_SESSION, (subject,))
+            conn.execute(SQL_LOG_CHANGE, (TOPIC_SESSION, subject, PROCESS_ID))
+            row = conn.execute(SQL_SESSION_ACTIVE, (subject,)).fetchone()
+        return bool(row and row[0])
+
+    @METRICS.timed("db.attendance_count")
+    def attendance_count(self, subject, day):
+        return self.conn().execute(SQL_ATTENDANCE_COUNT, (subject, day)).fetchone()[0]
+
+    @METRICS.timed("db.dashboard_states")
+    def dashboard_states(self, day, instructor_id=None):
+        """{subject: (is_active, present_count)} لكل المواد (أو مواد دكتور واحد) في يوم معين."""
+        rows = self.conn().execute(SQL_DASHBOARD_INSTRUCTOR, (day, instructor_id)) if instructor_id else self.conn().execute(SQL_DASHBOARD, (day,))
+        return {sub: (bool(active), cnt) for sub, active, cnt in rows}
+
+    # --- الجدول الدراسي ---
+    @METRICS.timed("db.schedule")
+    def schedule(self, instructor_id=None):
+        """[(day, subject, start_time, room)] مرتبة حسب اليوم ثم الترتيب في الجدول."""
+        if instructor_id: return self.conn().execute(SQL_INSTRUCTOR_SCHEDULE, (instructor_id,)).fetchall()
+        return self.conn().execute(SQL_SCHEDULE).fetchall()
+
+    def rooms_for_day(self, day):
+        """{room: [subject, ...]} ليوم معين (مثل 'Sunday')."""
+        rooms = {}
+        for room, sub in self.conn().execute(SQL_DAY_ROOMS, (day,)): rooms.setdefault(room, []).append(sub)
+        return rooms
+
+    @METRICS.timed("db.roster")
+    def roster(self, subject, day):
+        return self.conn().execute(SQL_ROSTER, (subject, day)).fetchall()
+
+    @METRICS.timed("db.get_encoding")
+    def get_encoding(self, student_id):
+        row = self.conn().execute(SQL_GET_ENCODING, (student_id,)).fetchone()
+        from gallery import decode_encoding  # numpy يُحمّل عند الحاجة فقط (سرعة بدء التشغيل)
+        return decode_encoding(row[0]) if row and row[0] is not None else None
+
+    @METRICS.timed("db.save_encoding")
+    def save_encoding(self, student_id, encoding):
+        from gallery import save_encoding
+        with self.transaction() as conn: save_encoding(conn, student_id, encoding)
+
+    @METRICS.timed("db.mark_attendance")
+    def mark_attendance(self, student_id, subject, day):
+        """True إذا سُجل الحضور الآن، False إذا كان مسجلاً من قبل."""
+        with self.transaction() as conn:
+            if conn.execute(SQL_MARK_ATTENDANCE, (student_id, subject, day, day)).rowcount == 0: return False
+            conn.execute(SQL_LOG_CHANGE, (TOPIC_ATTENDANCE, subject, PROCESS_ID))
+            return True
+
+    # --- سجل التغييرات (للبرامج الأخرى) ---
+    def data_version(self):
+        return self.conn().execute("PRAGMA data_version").fetchone()[0]
+
+    def last_change_seq(self):
+        return self.conn().execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+
+    @METRICS.timed("db.changes_since")
+    def changes_since(self, seq):
+        return self.conn().execute(SQL_CHANGES_SINCE, (seq, PROCESS_ID)).fetchall()
+
+    def prune_changes(self, keep=CHANGE_LOG_KEEP, conn=None):
+        # عند بدء ChangeFeed ودورياً من كاتب الحضور (create_schema لا تعمل إلا عند تغيير الإصدار)
+        (conn or self.conn()).execute(SQL_PRUNE_CHANGES, (keep,))
+
+
+def create_schema(conn):
+    """الجداول الأساسية ثم كل التحديثات عليها (كلها idempotent)."""
+    from gallery import migrate_encodings
+    conn.execute('''CREATE TABLE IF NOT EXISTS students (
+                    student_id TEXT PRIMARY KEY, secret_code TEXT, name TEXT,
+                    face_encoding BLOB, is_face_registered INTEGER DEFAULT 0)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS instructors (
+                    instructor_id TEXT PRIMARY KEY, secret_code TEXT, name TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS sessions (
+                    subject_name TEXT PRIMARY KEY, is_active INTEGER DEFAULT 0)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS attendance (
+                    student_id TEXT, subject_name TEXT, timestamp TEXT,
+                    UNIQUE(student_id, subject_name, timestamp))''')
+    migrate_encodings(conn)
+    migrate_attendance(conn)
+    migrate_change_log(conn)
+    migrate_schedule(conn)
+
+
+def migrate_schedule(conn):
+    # الجدول وتوزيع المواد في قاعدة البيانات بدل القواميس الثابتة (schedule.py قيم أولية فقط)
+    conn.execute("""CREATE TABLE IF NOT EXISTS schedule (
+                    id INTEGER PRIMARY KEY, day TEXT, day_index INTEGER, position INTEGER,
+                    subject_name TEXT, start_time TEXT, room TEXT)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS subject_instructors (
+                    subject_name TEXT PRIMARY KEY, instructor_id TEXT)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_schedule_day ON schedule (day_index, position)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_schedule_subject ON schedule (subject_name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_subject_instructors_instructor ON subject_instructors (instructor_id)")
+    if conn.execute("SELECT 1 FROM schedule LIMIT 1").fetchone() is None:
+        from schedule import WEEKLY_SCHEDULE
+        conn.executemany("INSERT INTO schedule (day, day_index, position, subject_name, start_time, room) VALUES (?, ?, ?, ?, ?, ?)",
+                         [(day, DAYS.index(day), pos, sub, at, room) for day, subs in WEEKLY_SCHEDULE.items() for pos, (sub, at, room) in enumerate(subs)])
+    if conn.execute("SELECT 1 FROM subject_instructors LIMIT 1").fetchone() is None:
+        from schedule import SUBJECT_INSTRUCTORS
+        conn.executemany("INSERT INTO subject_instructors VALUES (?, ?)", SUBJECT_INSTRUCTORS.items())
+    conn.execute("INSERT OR IGNORE INTO sessions (subject_name, is_active) SELECT DISTINCT subject_name, 0 FROM schedule")
+
+
+def migrate_attendance(conn):
+    # عمود date بدل timestamp LIKE 'YYYY-MM-DD%' الذي لا يستفيد من أي فهرس
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(attendance)")]
+    if "date" not in cols:
+        conn.execute("ALTER TABLE attendance ADD COLUMN date TEXT")
+        conn.execute("UPDATE attendance SET date = substr(timestamp, 1, 10)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_attendance_subject_date ON attendance (subject_name, date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_attendance_student_date ON attendance (student_id, date)")
+
+
+def migrate_change_log(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS change_log (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT, subject_name TEXT, origin TEXT)""")
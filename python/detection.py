@@ -0,0 +1,109 @@
+from collections import deque
+import cv2
+import face_recognition
+import numpy as np
+from metrics import METRICS
+
+# --- طبقة كشف الوجوه ---
+# HOG من dlib هو أغلى خطوة في كل إطار، فيسبقه فحصان رخيصان:
+# 1) فرق الحركة على صورة مصغرة جداً (لكل خلية، فحركة وجه صغير تكفي): مشهد ثابت = نفس صناديق
+#    الإطار السابق، مع كشف حقيقي كل STATIC_REDETECT إطارات، ودائماً إذا لم يكن هناك وجه.
+# 2) Haar cascade من OpenCV: لا مرشحين = لا وجه (مع HOG كامل كل HOG_FALLBACK_EVERY إطارات)،
+#    وإلا يعمل HOG على منطقة المرشحين فقط.
+# مقياس التصغير لـ HOG يُختار من حجم الوجوه في الإطارات الأخيرة.
+
+DETECT_SCALE = 0.5
+TARGET_FACE_SIZE = 100     # حجم الوجه (بكسل) المطلوب بعد التصغير، يكفي HOG براحة
+MIN_SCALE, MAX_SCALE = 0.25, 1.0
+MOTION_THRESHOLD = 8.0     # متوسط فرق الرمادي في أي خلية من خلايا الصورة المصغرة
+MOTION_CELLS = (16, 12)    # 64x48 -> خلايا 4x4 بكسل (~1/16 من عرض الإطار)
+STATIC_REDETECT = 10       # أقصى عدد إطارات متتالية تُعاد فيها الصناديق القديمة بدون كشف
+ROI_MARGIN = 0.4
+HOG_FALLBACK_EVERY = 5  # الـ cascade للوجه الأمامي فقط: HOG كامل كل N إطارات فارغة حتى لا يضيع وجه جانبي
+
+
+def _load_cascade():
+    try:
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+        return None if cascade.empty() else cascade
+    except (AttributeError, cv2.error): return None
+
+
+def scale_boxes(boxes, factor, dx=0, dy=0):
+    """تحويل صناديق (top, right, bottom, left) من صورة مصغرة/مقصوصة لإحداثيات الإطار الكامل."""
+    return [(int(round(t * factor)) + dy, int(round(r * factor)) + dx, int(round(b * factor)) + dy, int(round(l * factor)) + dx)
+            for t, r, b, l in boxes]
+
+
+def detect_faces(frame, scale=DETECT_SCALE):
+    """HOG على نسخة مصغرة، والصناديق ترجع بإحداثيات الإطار الكامل."""
+    with METRICS.timer("detect.resize"):
+        small = cv2.resize(frame, (0, 0), fx=scale, fy=scale) if scale != 1 else frame
+        rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+    with METRICS.timer("detect.face_locations"): boxes = face_recognition.face_locations(rgb)
+    return scale_boxes(boxes, 1.0 / scale)
+
+
+def encode_faces(frame, boxes):
+    # الصناديق من الكشف نفسه، فلا يعيد face_encodings كشفاً كاملاً على الإطار
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    with METRICS.timer("detect.face_encodings"): return face_recognition.face_encodings(rgb, boxes)
+
+
+class FaceDetector:
+    def __init__(self, use_cascade=True, use_motion=True, history=10):
+        self.cascade = _load_cascade() if use_cascade else None
+        self.use_motion = use_motion
+        self.sizes = deque(maxlen=history)
+        self.last_boxes = []; self._prev_thumb = None
+        self.stats = {"static": 0, "cascade_empty": 0, "hog": 0, "fallback": 0}
+        self._empty_run = 0; self._static_run = 0
+
+    @property
+    def scale(self):
+        if not self.sizes: return DETECT_SCALE
+        return float(np.clip(TARGET_FACE_SIZE / float(np.median(self.sizes)), MIN_SCALE, MAX_SCALE))
+
+    def __call__(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.use_motion and self._static(gray) and self.last_boxes and self._static_run < STATIC_REDETECT:
+            self._static_run += 1; self.stats["static"] += 1; METRICS.incr("detect.static")
+            return list(self.last_boxes)
+        self._static_run = 0
+        boxes = self._detect(frame, gray)
+        self.last_boxes = boxes
+        for t, r, b, l in boxes: self.sizes.append(max(r - l, b - t))
+        return boxes
+
+    def _static(self, gray):
+        thumb = cv2.resize(gray, (64, 48), interpolation=cv2.INTER_AREA)
+        prev, self._prev_thumb = self._prev_thumb, thumb
+        if prev is None: return False
+        # أكبر متوسط فرق بين الخلايا، وليس المتوسط على الصورة كلها
+        cells = cv2.resize(cv2.absdiff(thumb, prev), MOTION_CELLS, interpolation=cv2.INTER_AREA)
+        return float(cells.max()) < MOTION_THRESHOLD
+
+    def _detect(self, frame, gray):
+        if self.cascade is None:
+            self.stats["hog"] += 1
+            return detect_faces(frame, self.scale)
+        h, w = gray.shape
+        f = min(1.0, 320.0 / w)
+        small = cv2.resize(gray, (0, 0), fx=f, fy=f) if f < 1 else gray
+        with METRICS.timer("detect.cascade"): cands = self.cascade.detectMultiScale(small, scaleFactor=1.2, minNeighbors=3, minSize=(24, 24))
+        if len(cands) == 0:
+            self.stats["cascade_empty"] += 1; METRICS.incr("detect.cascade_empty")
+            self._empty_run += 1
+            if self._empty_run % HOG_FALLBACK_EVERY: return []
+            self.stats["fallback"] += 1; METRICS.incr("detect.fallback")
+            return detect_faces(frame, self.scale)
+        self._empty_run = 0; self._static_run = 0
+        # HOG على المنطقة التي تحوي المرشحين فقط (مع هامش)، بمقياس من حجمهم
+        cands = np.asarray(cands, dtype=np.float32) / f
+        x0, y0 = cands[:, 0].min(), cands[:, 1].min()
+        x1, y1 = (cands[:, 0] + cands[:, 2]).max(), (cands[:, 1] + cands[:, 3]).max()
+        m = ROI_MARGIN * float(cands[:, 2:].max())
+        x0, y0 = max(0, int(x0 - m)), max(0, int(y0 - m)); x1, y1 = min(w, int(x1 + m)), min(h, int(y1 + m))
+        if not self.sizes: self.sizes.append(float(np.median(cands[:, 2])))
+        self.stats["hog"] += 1
+        return scale_boxes(detect_faces(frame[y0:y1, x0:x1], self.scale), 1.0, x0, y0)
@@ -0,0 +1,124 @@
+import argparse
+import hashlib
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from db import SCHEMA_VERSION, Database, create_schema
+from gallery import FaceGallery, save_encoding
+
+# --- تسجيل جماعي من مجلد صور ---
+# نفس ترتيب IMAGES_DIR: <student_id>_<angle>.jpg
+# البصمات تُحسب بالتوازي (process لكل نواة)، ومتوسط الزوايا كما في run_camera،
+# والكتابة على دفعات في transaction واحدة. الطالب الذي لم تتغير صوره يُتخطى.
+#
+#   python enroll.py student_faces --workers 8
+
+IMAGE_RE = re.compile(r"^(?P<sid>.+)_(?P<angle>[^_]+)\.(jpe?g|png)$", re.IGNORECASE)
+MAX_SIDE = 1024  # صور الهويات الكبيرة تُصغر قبل الكشف
+
+
+def scan_images(root):
+    groups = defaultdict(list)
+    with os.scandir(root) as it:
+        for entry in it:
+            m = IMAGE_RE.match(entry.name)
+            if m and entry.is_file(): groups[m.group("sid")].append(entry.path)
+    return {sid: sorted(paths) for sid, paths in groups.items()}
+
+
+def fingerprint(paths):
+    h = hashlib.sha1()
+    for p in paths:
+        st = os.stat(p)
+        h.update(f"{os.path.basename(p)}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()
+
+
+def encode_student(job):
+    # يعمل داخل process منفصل، لذلك الاستيراد هنا
+    import cv2
+    import face_recognition
+    sid, paths, fp = job
+    encs = []; errors = []
+    for p in paths:
+        try:
+            img = face_recognition.load_image_file(p)
+            f = MAX_SIDE / float(max(img.shape[:2]))
+            if f < 1: img = cv2.resize(img, (0, 0), fx=f, fy=f, interpolation=cv2.INTER_AREA)
+            boxes = face_recognition.face_locations(img)
+            if not boxes: errors.append(f"{os.path.basename(p)}: no face"); continue
+            # أكبر وجه في الصورة
+            box = max(boxes, key=lambda b: (b[2] - b[0]) * (b[1] - b[3]))
+            encs.append(face_recognition.face_encodings(img, [box])[0])
+        except Exception as e: errors.append(f"{os.path.basename(p)}: {e}")
+    return sid, fp, (np.mean(encs, axis=0) if encs else None), len(encs), errors
+
+
+def ensure_schema(db, conn):
+    # قاعدة جديدة (بداية الفصل قبل تشغيل main.py) تُنشأ كاملة مثل scanner.py
+    if db.schema_version() != SCHEMA_VERSION: create_schema(conn); db.set_schema_version(conn, SCHEMA_VERSION)
+    conn.execute("""CREATE TABLE IF NOT EXISTS enrollment_sources (
+                    student_id TEXT PRIMARY KEY, fingerprint TEXT, images INTEGER, enrolled_at TEXT)""")
+
+
+def enroll_directory(root, db, workers=None, batch_size=200, min_images=1, create_missing=False, force=False, log=print):
+    with db.transaction() as conn: ensure_schema(db, conn)
+    conn = db.conn()
+    known = {r[0] for r in conn.execute("SELECT student_id FROM students")}
+    done = dict(conn.execute("SELECT student_id, fingerprint FROM enrollment_sources"))
+    jobs = []; stats = defaultdict(int)
+    for sid, paths in scan_images(root).items():
+        if sid not in known and not create_missing: stats["unknown"] += 1; continue
+        fp = fingerprint(paths)
+        if not force and done.get(sid) == fp: stats["unchanged"] += 1; continue
+        jobs.append((sid, paths, fp))
+    log(f"{len(jobs)} students to encode ({stats['unchanged']} unchanged, {stats['unknown']} not in students table)")
+
+    pending = []; start = time.time()
+    def flush():
+        with db.transaction() as c:
+            for sid, fp, enc, n in pending:
+                if sid not in known: c.execute("INSERT OR IGNORE INTO students (student_id) VALUES (?)", (sid,))
+                save_encoding(c, sid, enc)
+                c.execute("INSERT OR REPLACE INTO enrollment_sources VALUES (?, ?, ?, datetime('now'))", (sid, fp, n))
+        pending.clear()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for i, (sid, fp, enc, n, errors) in enumerate(pool.map(encode_student, jobs, chunksize=8), 1):
+            for e in errors: log(f"  {sid}: {e}")
+            if enc is None or n < min_images: stats["failed"] += 1
+            else:
+                pending.append((sid, fp, enc, n)); stats["enrolled"] += 1
+                if len(pending) >= batch_size: flush()
+            if i % 500 == 0: log(f"  {i}/{len(jobs)} ({i / (time.time() - start):.1f} students/s)")
+    if pending: flush()
+    log(f"Enrolled {stats['enrolled']}, failed {stats['failed']} in {time.time() - start:.1f}s")
+    return dict(stats)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Bulk face enrollment from an image folder (<student_id>_<angle>.jpg)")
+    ap.add_argument("directory")
+    ap.add_argument("--db", default="attendance.db")
+    ap.add_argument("--gallery", default="gallery.npy", help="gallery cache to refresh afterwards ('' to skip)")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--batch", type=int, default=200)
+    ap.add_argument("--min-images", type=int, default=1)
+    ap.add_argument("--create-missing", action="store_true", help="add students that are not in the students table")
+    ap.add_argument("--force", action="store_true", help="re-encode even if the images did not change")
+    args = ap.parse_args(argv)
+    if not os.path.isdir(args.directory): ap.error(f"not a directory: {args.directory}")
+    db = Database(args.db)
+    try:
+        stats = enroll_directory(args.directory, db, args.workers, args.batch, args.min_images, args.create_missing, args.force)
+        if args.gallery and stats.get("enrolled"): FaceGallery().load(db.conn(), args.gallery)
+    finally: db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+import threading
+from collections import defaultdict
+
+# --- ناقل الأحداث ---
+# الأحداث داخل نفس البرنامج تصل فوراً عبر EventBus، وتغييرات البرامج الأخرى
+# (كشك آخر، محطة دكتور ثانية) تُقرأ من جدول change_log عبر ChangeFeed.
+# المستمع يُستدعى على نفس thread الناشر.
+
+TOPIC_SESSION = "session"
+TOPIC_ATTENDANCE = "attendance"
+
+
+class EventBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs = defaultdict(list)
+
+    def subscribe(self, topic, callback):
+        with self._lock: self._subs[topic].append(callback)
+        return lambda: self.unsubscribe(topic, callback)
+
+    def unsubscribe(self, topic, callback):
+        with self._lock:
+            if callback in self._subs[topic]: self._subs[topic].remove(callback)
+
+    def publish(self, topic, **data):
+        with self._lock: subs = list(self._subs[topic])
+        for callback in subs:
+            try: callback(**data)
+            except Exception as e: print(f"Event handler error ({topic}): {e}")
+
+
+class ChangeFeed:
+    def __init__(self, db, bus):
+        self.db = db; self.bus = bus
+        self._data_version = None
+        db.prune_changes()
+        self._last_seq = db.last_change_seq()
+
+    def poll(self):
+        # PRAGMA data_version يتغير فقط عندما يكتب اتصال آخر، فالفحص الدوري شبه مجاني
+        version = self.db.data_version()
+        if version == self._data_version: return 0
+        self._data_version = version
+        changes = self.db.changes_since(self._last_seq)
+        if not changes: return 0
+        self._last_seq = changes[-1][0]
+        # دمج التغييرات المتكررة لنفس المادة في حدث واحد
+        for topic, subject in dict.fromkeys((topic, subject) for _, topic, subject in changes):
+            self.bus.publish(topic, subject=subject)
+        return len(changes)
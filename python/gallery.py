@@ -0,0 +1,215 @@
+import io
+import json
+import os
+import pickle
+import struct
+import threading
+import numpy as np
+from metrics import METRICS
+
+# --- صيغة تخزين البصمة ---
+# ترويسة صغيرة (توقيع + رقم إصدار + طول المتجه) ثم float32 خام little-endian.
+# تُقرأ بـ np.frombuffer مباشرة بدون pickle (pickle غير آمن من قاعدة مشتركة).
+ENCODING_MAGIC = b"YE"
+ENCODING_VERSION = 1
+_HEADER = struct.Struct("<2sBH")
+
+
+def encode_encoding(encoding):
+    v = np.ascontiguousarray(encoding, dtype="<f4").ravel()
+    return _HEADER.pack(ENCODING_MAGIC, ENCODING_VERSION, v.size) + v.tobytes()
+
+
+def decode_encoding(blob):
+    if blob is None or len(blob) < _HEADER.size: raise ValueError("Invalid face encoding")
+    magic, version, dim = _HEADER.unpack_from(blob)
+    if magic != ENCODING_MAGIC or version != ENCODING_VERSION: raise ValueError(f"Unsupported face encoding (version {version})")
+    if len(blob) != _HEADER.size + dim * 4: raise ValueError("Truncated face encoding")
+    return np.frombuffer(blob, dtype="<f4", count=dim, offset=_HEADER.size)
+
+
+def is_encoded(blob): return blob is not None and bytes(blob[:2]) == ENCODING_MAGIC
+
+
+def save_encoding(conn, student_id, encoding):
+    # encoding_seq يزيد مع كل تسجيل حتى يُحدَّث ملف المعرض بالصفوف الجديدة فقط
+    conn.execute("UPDATE students SET face_encoding=?, is_face_registered=1, encoding_seq=(SELECT COALESCE(MAX(encoding_seq), 0)+1 FROM students) WHERE student_id=?",
+                 (encode_encoding(encoding), student_id))
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+    # البصمات القديمة مصفوفات numpy فقط، أي global آخر في الـ blob يُرفض
+    ALLOWED = {("numpy.core.multiarray", "_reconstruct"), ("numpy._core.multiarray", "_reconstruct"),
+               ("numpy.core.numeric", "_frombuffer"), ("numpy._core.numeric", "_frombuffer"),  # protocol 5
+               ("numpy", "ndarray"), ("numpy", "dtype"), ("_codecs", "encode")}  # _codecs: bytes في protocol 2
+
+    def find_class(self, module, name):
+        if (module, name) not in self.ALLOWED: raise pickle.UnpicklingError(f"Forbidden global {module}.{name}")
+        return super().find_class(module, name)
+
+
+def load_legacy_encoding(blob):
+    enc = _ArrayUnpickler(io.BytesIO(blob)).load()
+    if not isinstance(enc, np.ndarray): raise ValueError(f"Not an array: {type(enc).__name__}")
+    return enc
+
+
+def migrate_encodings(conn):
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(students)")]
+    if "encoding_seq" not in cols: conn.execute("ALTER TABLE students ADD COLUMN encoding_seq INTEGER DEFAULT 0")
+    # MAX(encoding_seq) في save_encoding و"encoding_seq > ?" في _load_rows بدون مسح الجدول كله
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_students_encoding_seq ON students (encoding_seq)")
+    conn.execute("CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY, applied_at TEXT)")
+    if conn.execute("SELECT 1 FROM migrations WHERE name='encodings_v1'").fetchone(): return
+    # تحويل البصمات القديمة (pickle float64) مرة واحدة للصيغة الجديدة
+    for sid, blob in conn.execute("SELECT student_id, face_encoding FROM students WHERE face_encoding IS NOT NULL").fetchall():
+        if is_encoded(blob): continue
+        try: enc = load_legacy_encoding(blob)
+        except Exception as e: print(f"Skipping encoding of {sid}: {e}"); continue
+        conn.execute("UPDATE students SET face_encoding=? WHERE student_id=?", (encode_encoding(enc), sid))
+    conn.execute("INSERT INTO migrations VALUES ('encodings_v1', datetime('now'))")
+
+
+# --- محرك التعرف 1:N ---
+# كل البصمات المسجلة في مصفوفة float32 واحدة متصلة (N x 128)،
+# والمقارنة مع الوجه الملتقط تتم بعملية مصفوفات واحدة بدل حلقة على الطلاب.
+
+ENCODING_DIM = 128
+DEFAULT_THRESHOLD = 0.5
+
+
+class FaceGallery:
+    def __init__(self, dim=ENCODING_DIM, capacity=1024):
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._sq_norms = np.zeros(capacity, dtype=np.float32)
+        self._ids = []
+        self._index = {}
+        self._seq = -1
+
+    def __len__(self): return len(self._ids)
+    def __contains__(self, student_id): return student_id in self._index
+
+    @property
+    def ids(self): return list(self._ids)
+
+    @property
+    def matrix(self):
+        with self._lock: return self._matrix[:len(self._ids)]
+
+    def load(self, conn, cache_path=None):
+        """يحمّل البصمات من قاعدة البيانات. مع cache_path يُفتح ملف المعرض
+        بـ mmap وتُقرأ من الجدول فقط الصفوف التي تغيرت بعد آخر حفظ."""
+        with self._lock:
+            cached = bool(cache_path) and self.load_file(cache_path)
+            if not cached: self._reset()
+            changed = self._load_rows(conn, self._seq)
+            total = conn.execute("SELECT COUNT(*) FROM students WHERE is_face_registered=1 AND face_encoding IS NOT NULL").fetchone()[0]
+            if cached and total != len(self._ids):
+                # طالب حُذف أو أُلغي تسجيله: إعادة بناء كاملة
+                self._reset(); changed = self._load_rows(conn, -1); cached = False
+        if cache_path and (changed or not cached):
+            try: self.save(cache_path)
+            except OSError as e: print(f"Gallery cache not saved: {e}")
+        return self
+
+    def save(self, path):
+        meta_path = _meta_path(path)
+        with self._lock:
+            # ويندوز لا يسمح باستبدال ملف مفتوح بـ mmap، فننسخ المصفوفة للذاكرة أولاً
+            if isinstance(self._matrix, np.memmap): self._matrix = np.array(self._matrix)
+            n = len(self._ids)
+            meta = {"version": ENCODING_VERSION, "dim": self.dim, "count": n, "seq": self._seq, "ids": list(self._ids)}
+            with open(path + ".tmp", "wb") as f: np.save(f, self._matrix[:n])
+            with open(meta_path + ".tmp", "w", encoding="utf-8") as f: json.dump(meta, f)
+        os.replace(path + ".tmp", path); os.replace(meta_path + ".tmp", meta_path)
+
+    def upsert(self, student_id, encoding):
+        with self._lock: self._put(student_id, encoding)
+
+    def remove(self, student_id):
+        # نقل آخر صف مكان الصف المحذوف حتى تبقى المصفوفة متصلة بلا فراغات
+        with self._lock:
+            i = self._index.pop(student_id, None)
+            if i is None: return False
+            last = len(self._ids) - 1
+            if i != last:
+                moved = self._ids[last]
+                self._matrix[i] = self._matrix[last]; self._sq_norms[i] = self._sq_norms[last]
+                self._ids[i] = moved; self._index[moved] = i
+            self._ids.pop()
+            return True
+
+    def distances(self, probe):
+        # ||g - p||^2 = ||g||^2 - 2 g.p + ||p||^2  (ضرب مصفوفة في متجه واحد لكل الطلاب)
+        p = np.asarray(probe, dtype=np.float32).reshape(self.dim)
+        with self._lock:
+            n = len(self._ids)
+            d2 = self._sq_norms[:n] - 2.0 * (self._matrix[:n] @ p) + float(p @ p)
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2, out=d2)
+
+    @METRICS.timed("match.identify")
+    def identify(self, probe, threshold=DEFAULT_THRESHOLD, k=1):
+        """يرجع أقرب k طلاب مرتبين [(student_id, distance)] ضمن حد المسافة."""
+        with self._lock:
+            n = len(self._ids)
+            if n == 0: return []
+            d = self.distances(probe)
+            k = min(k, n)
+            top = np.argpartition(d, k - 1)[:k] if k < n else np.arange(n)
+            top = top[np.argsort(d[top], kind="stable")]
+            ids = self._ids
+            return [(ids[i], float(d[i])) for i in top if d[i] <= threshold]
+
+    @METRICS.timed("match.verify")
+    def verify(self, student_id, probe, threshold=DEFAULT_THRESHOLD):
+        with self._lock:
+            i = self._index.get(student_id)
+            if i is None: return False
+            p = np.asarray(probe, dtype=np.float32).reshape(self.dim)
+            return float(np.linalg.norm(self._matrix[i] - p)) <= threshold
+
+    def _reset(self):
+        self._ids = []; self._index = {}; self._seq = -1
+
+    def _load_rows(self, conn, since):
+        rows = conn.execute("SELECT student_id, face_encoding, encoding_seq FROM students WHERE is_face_registered=1 AND face_encoding IS NOT NULL AND encoding_seq > ?", (since,)).fetchall()
+        self._reserve(len(self._ids) + len(rows))
+        for sid, blob, seq in rows:
+            try: self._put(sid, decode_encoding(blob))
+            except ValueError as e: print(f"Skipping encoding of {sid}: {e}"); continue
+            self._seq = max(self._seq, seq or 0)
+        return len(rows)
+
+    def load_file(self, path):
+        try:
+            with open(_meta_path(path), encoding="utf-8") as f: meta = json.load(f)
+            # copy-on-write: القراءة من الملف مباشرة، وأي تعديل يبقى في الذاكرة فقط
+            m = np.load(path, mmap_mode="c")
+        except (OSError, ValueError): return False
+        if meta.get("version") != ENCODING_VERSION or m.dtype != np.float32 or m.shape != (meta.get("count"), self.dim): return False
+        self._matrix = m
+        self._sq_norms = np.einsum("ij,ij->i", m, m).astype(np.float32)
+        self._ids = list(meta["ids"]); self._index = {sid: i for i, sid in enumerate(self._ids)}
+        self._seq = meta["seq"]
+        return True
+
+    def _reserve(self, n):
+        if n <= self._matrix.shape[0]: return
+        cap = max(n, self._matrix.shape[0] * 2)
+        m = np.zeros((cap, self.dim), dtype=np.float32); m[:len(self._ids)] = self._matrix[:len(self._ids)]
+        s = np.zeros(cap, dtype=np.float32); s[:len(self._ids)] = self._sq_norms[:len(self._ids)]
+        self._matrix, self._sq_norms = m, s
+
+    def _put(self, student_id, encoding):
+        v = np.asarray(encoding, dtype=np.float32).reshape(self.dim)
+        i = self._index.get(student_id)
+        if i is None:
+            i = len(self._ids); self._reserve(i + 1)
+            self._ids.append(student_id); self._index[student_id] = i
+        self._matrix[i] = v; self._sq_norms[i] = float(v @ v)
+
+
+def _meta_path(path): return os.path.splitext(path)[0] + ".ids.json"
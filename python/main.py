@@ -1,84 +1,102 @@
+import time
+STARTUP_T0 = time.perf_counter()
 import tkinter as tk
 from tkinter import messagebox, ttk
-import sqlite3
-import cv2
-import face_recognition
-import numpy as np
-import pickle
 import os
 import threading
 import queue
 from datetime import datetime
-import time
+import json
+from db import SCHEMA_VERSION, Database, create_schema
+from events import TOPIC_ATTENDANCE, TOPIC_SESSION, ChangeFeed, EventBus
+from metrics import METRICS, JsonlReporter
+from recorder import AttendanceRecorder
+# cv2 وface_recognition وnumpy تُحمّل في الخلفية (warm_up) حتى تظهر شاشة الدخول فوراً
+cv2 = np = FacePipeline = FaceDetector = encode_faces = GALLERY = None
 
 # --- إعدادات وثوابت ---
 DB_NAME = 'attendance.db'
 IMAGES_DIR = 'student_faces'
+CAMERA_INDEX = 0
+DETECT_STRIDE = 2 # الكشف كل إطارين، وبينهما تُستخدم آخر صناديق
+GALLERY_FILE = 'gallery.npy' # None لتعطيل ملف المعرض (mmap)
+STARTUP_LOG = 'startup.log' # زمن بدء التشغيل (JSON سطر لكل تشغيل)
+METRICS_LOG = None # مثلاً 'metrics.jsonl': إحصائيات زمن المراحل كل METRICS_INTERVAL ثانية
+METRICS_INTERVAL = 10
+STATS_PANEL = False # F12 يفتح نافذة الإحصائيات
 BG_COLOR = "#f0f4f8"
 PRIMARY_COLOR = "#2980b9"
 ACCENT_COLOR = "#27ae60"
 ERROR_COLOR = "#c0392b"
 FONT_HEADER = ("Helvetica", 20, "bold")
 FONT_NORMAL = ("Helvetica", 12)
+MATCH_THRESHOLD = 0.5
+CHANGE_POLL_MS = 1000 # فحص تغييرات البرامج الأخرى (PRAGMA data_version فقط إذا لم يتغير شيء)
 
 if not os.path.exists(IMAGES_DIR):
     os.makedirs(IMAGES_DIR)
 
-# --- توزيع المواد على الدكاترة ---
-SUBJECT_INSTRUCTORS = {
-    "Mathematics": "dr_math",
-    "Physics": "dr_math",
-    "Science": "dr_math",
-    "Chemistry": "dr_math",
-    "Programming": "dr_cs",
-    "Algorithms": "dr_cs",
-    "Networks": "dr_cs",
-    "Databases": "dr_cs",
-    "Graduation Project": "dr_cs",
-    "Seminar": "dr_cs",
-    "English": "dr_math"
-}
-
-# --- الجدول الدراسي ---
-WEEKLY_SCHEDULE = {
-    "Sunday": [("Mathematics", "08:00 AM", "Room 101"), ("Science", "10:00 AM", "Lab A")],
-    "Monday": [("Physics", "09:00 AM", "Lab B"), ("Programming", "11:00 AM", "Computer Lab")],
-    "Tuesday": [("Mathematics", "08:30 AM", "Room 101"), ("Algorithms", "10:30 AM", "Room 202")],
-    "Wednesday": [("Networks", "09:00 AM", "Net Lab"), ("Databases", "12:00 PM", "PC Lab")],
-    "Thursday": [("Graduation Project", "08:00 AM", "Auditorium")]
-}
-
 # --- إعداد قاعدة البيانات ---
+DB = Database(DB_NAME)
+
 def create_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS students (
-                    student_id TEXT PRIMARY KEY, secret_code TEXT, name TEXT,
-                    face_encoding BLOB, is_face_registered INTEGER DEFAULT 0)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS instructors (
-                    instructor_id TEXT PRIMARY KEY, secret_code TEXT, name TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS sessions (
-                    subject_name TEXT PRIMARY KEY, is_active INTEGER DEFAULT 0)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS attendance (
-                    student_id TEXT, subject_name TEXT, timestamp TEXT,
-                    UNIQUE(student_id, subject_name, timestamp))''')
+    if DB.schema_version() == SCHEMA_VERSION: return
+    with DB.transaction() as conn:
+        c = conn.cursor()
+        create_schema(conn)
     
-    try:
-        c.execute("INSERT OR IGNORE INTO students (student_id, secret_code, name) VALUES (?, ?, ?)", ('101', '1234', 'Ahmed Ali'))
-        c.execute("INSERT OR IGNORE INTO instructors (instructor_id, secret_code, name) VALUES (?, ?, ?)", ('dr_math', '1000', 'Dr. Sami'))
-        c.execute("INSERT OR IGNORE INTO instructors (instructor_id, secret_code, name) VALUES (?, ?, ?)", ('dr_cs', '2000', 'Dr. Omar'))
-        
-        all_subjects = []
-        for day_subs in WEEKLY_SCHEDULE.values():
-            for s in day_subs: all_subjects.append(s[0])
-        for sub in set(all_subjects):
-            c.execute("INSERT OR IGNORE INTO sessions (subject_name, is_active) VALUES (?, 0)", (sub,))
-        conn.commit()
-    except Exception as e: print(f"DB Error: {e}")
-    conn.close()
+        try:
+            c.execute("INSERT OR IGNORE INTO students (student_id, secret_code, name) VALUES (?, ?, ?)", ('101', '1234', 'Ahmed Ali'))
+            c.execute("INSERT OR IGNORE INTO instructors (instructor_id, secret_code, name) VALUES (?, ?, ?)", ('dr_math', '1000', 'Dr. Sami'))
+            c.execute("INSERT OR IGNORE INTO instructors (instructor_id, secret_code, name) VALUES (?, ?, ?)", ('dr_cs', '2000', 'Dr. Omar'))
+
+            DB.set_schema_version(conn, SCHEMA_VERSION)
+        except Exception as e: print(f"DB Error: {e}")
 
 create_db()
 
+BUS = EventBus()
+FEED = ChangeFeed(DB, BUS)
+RECORDER = AttendanceRecorder(DB)
+
+# --- تحميل مكتبات الرؤية في الخلفية ---
+VISION_READY = threading.Event()
+VISION_ERROR = None
+STARTUP_TIMES = {}
+
+_startup_lock = threading.Lock()
+
+def log_startup(stage):
+    with _startup_lock:
+        STARTUP_TIMES[stage] = round((time.perf_counter() - STARTUP_T0) * 1000, 1)
+        print(f"Startup: {stage} after {STARTUP_TIMES[stage]} ms")
+        # سطر واحد لكل تشغيل بعد ظهور شاشة الدخول وجاهزية النماذج
+        if not STARTUP_LOG or not {"login_shown", "vision_ready"} <= STARTUP_TIMES.keys(): return
+        try:
+            with open(STARTUP_LOG, "a", encoding="utf-8") as f: f.write(json.dumps({"at": datetime.now().isoformat(timespec="seconds"), **STARTUP_TIMES}) + "\n")
+        except OSError as e: print(f"Startup log error: {e}")
+
+def warm_up():
+    global cv2, np, FacePipeline, FaceDetector, encode_faces, GALLERY, VISION_ERROR
+    try:
+        import cv2
+        import numpy as np
+        from detection import FaceDetector, encode_faces
+        from gallery import FaceGallery
+        from pipeline import FacePipeline
+        log_startup("vision_imported")
+        # بصمات كل الطلاب في الذاكرة (تتحدث مباشرة عند تسجيل وجه جديد)
+        GALLERY = FaceGallery().load(DB.conn(), GALLERY_FILE)
+        # تشغيل النموذج مرة على صورة فارغة حتى لا يتأخر أول طالب
+        encode_faces(np.zeros((150, 150, 3), dtype=np.uint8), [(0, 150, 150, 0)])
+    except Exception as e: VISION_ERROR = str(e); print(f"Vision warm-up failed: {e}")
+    finally: DB.release()
+    VISION_READY.set(); log_startup("vision_ready")
+
+def wait_for_vision():
+    VISION_READY.wait()
+    return VISION_ERROR
+
 current_user = None
 current_user_role = None
 
@@ -107,19 +125,42 @@ class SmartAttendanceApp(tk.Tk):
         self.container.grid_rowconfigure(0, weight=1)
         self.container.grid_columnconfigure(0, weight=1)
         
-        self.frames = {}
-        for F in (LoginFrame, RegistrationFrame, TeacherDashboard, StudentDashboard):
-            frame = F(self.container, self)
-            self.frames[F] = frame
-            frame.grid(row=0, column=0, sticky="nsew") # nsew يعني التمدد في كل الاتجاهات
-            
+        # الشاشات تُبنى عند أول عرض لها، فقط شاشة الدخول تُبنى الآن
+        self.frames = {}; self.current = None
         self.show_frame(LoginFrame)
 
     def show_frame(self, frame_class):
-        frame = self.frames[frame_class]
+        frame = self.frames.get(frame_class)
+        if frame is None:
+            frame = self.frames[frame_class] = frame_class(self.container, self)
+            frame.grid(row=0, column=0, sticky="nsew") # nsew يعني التمدد في كل الاتجاهات
+        # كل الشاشات تبقى mapped تحت بعضها (grid)، فالشاشة الظاهرة تُعرف من هنا وليس من winfo_ismapped
+        if self.current is not frame and hasattr(self.current, 'on_hide'): self.current.on_hide()
+        self.current = frame
         frame.tkraise()
         if hasattr(frame, 'on_show'): frame.on_show()
 
+# --- نافذة الإحصائيات (F12) ---
+class StatsPanel(tk.Toplevel):
+    def __init__(self, master):
+        super().__init__(master, bg="white")
+        self.title("Performance Stats"); self.geometry("760x480")
+        cols = ("count", "mean", "p50", "p95", "p99", "max")
+        self.tree = ttk.Treeview(self, columns=cols)
+        self.tree.heading("#0", text="stage"); self.tree.column("#0", width=220)
+        for c in cols: self.tree.heading(c, text=c); self.tree.column(c, width=80, anchor="e")
+        self.tree.pack(fill="both", expand=True, padx=10, pady=10)
+        self.lbl = tk.Label(self, bg="white", font=("Consolas", 9), justify="left", anchor="w"); self.lbl.pack(fill="x", padx=10, pady=(0, 10))
+        self.refresh()
+
+    def refresh(self):
+        if not self.winfo_exists(): return
+        snap = METRICS.snapshot()
+        self.tree.delete(*self.tree.get_children())
+        for name, h in snap["timers"].items(): self.tree.insert("", "end", text=name, values=[h[c] for c in ("count", "mean", "p50", "p95", "p99", "max")])
+        self.lbl.config(text="  ".join(f"{k}={v}" for k, v in snap["counters"].items()) + "".join(f"\n{k}: {v}" for k, v in snap["errors"].items()))
+        self.after(1000, self.refresh)
+
 # --- Login ---
 class LoginFrame(tk.Frame):
     def __init__(self, parent, controller):
@@ -138,18 +179,16 @@ class LoginFrame(tk.Frame):
     def login(self):
         global current_user, current_user_role
         uid = self.entry_id.get(); code = self.entry_code.get()
-        conn = sqlite3.connect(DB_NAME); c = conn.cursor()
         
-        if c.execute("SELECT name FROM instructors WHERE instructor_id=? AND secret_code=?", (uid, code)).fetchone():
-            current_user = uid; current_user_role = 'teacher'; conn.close()
+        if DB.instructor_login(uid, code):
+            current_user = uid; current_user_role = 'teacher'
             self.controller.show_frame(TeacherDashboard)
             return
 
-        res = c.execute("SELECT is_face_registered FROM students WHERE student_id=? AND secret_code=?", (uid, code)).fetchone()
-        conn.close()
-        if res:
+        res = DB.student_login(uid, code)
+        if res is not None:
             current_user = uid; current_user_role = 'student'
-            self.controller.show_frame(RegistrationFrame if res[0]==0 else StudentDashboard)
+            self.controller.show_frame(RegistrationFrame if res==0 else StudentDashboard)
         else: messagebox.showerror("Error", "Invalid Credentials")
 
 # --- Registration ---
@@ -170,31 +209,30 @@ class RegistrationFrame(tk.Frame):
         threading.Thread(target=self.run_camera, daemon=True).start(); self.check_queue()
 
     def run_camera(self):
-        cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
-        if not cap.isOpened(): self.capture_queue.put(("error", "No Camera")); return
+        # التشفير هنا عند الضغط على CAPTURE فقط، فالـ worker يكشف الوجوه دون تشفير
+        if wait_for_vision(): self.capture_queue.put(("error", "Camera modules failed to load")); return
+        # بدون Haar cascade: لقطتا Right/Left وجه جانبي لا يراه cascade الوجه الأمامي
+        pipe = FacePipeline(CAMERA_INDEX, detect=FaceDetector(use_cascade=False), encode=None, detect_stride=DETECT_STRIDE)
+        if not pipe.start(): self.capture_queue.put(("error", "No Camera")); return
         encs = []; steps = ["Front", "Right", "Left"]; idx = 0
-        while idx < 3:
-            ret, frame = cap.read()
-            if not ret: continue
+        while idx < 3 and pipe.running:
+            item, res = pipe.next_frame()
+            if item is None: continue
             try:
-                frame = np.ascontiguousarray(frame.astype(np.uint8))
-                rgb = cv2.cvtColor(cv2.resize(frame, (0,0), fx=0.5, fy=0.5), cv2.COLOR_BGR2RGB)
-                boxes = face_recognition.face_locations(rgb)
+                frame = item[1].copy(); boxes = res.boxes if res else []
                 color = (0, 255, 0) if boxes else (0, 0, 255)
                 if boxes:
-                    t,r,b,l = boxes[0]; cv2.rectangle(frame, (l*2, t*2), (r*2, b*2), color, 2)
+                    t,r,b,l = boxes[0]; cv2.rectangle(frame, (l, t), (r, b), color, 2)
                 cv2.putText(frame, f"{steps[idx]}", (20,40), 4, 1, color, 2)
-                cv2.imshow("Registration", frame)
-                key = cv2.waitKey(30)
+                with METRICS.timer("display.show"): cv2.imshow("Registration", frame); key = cv2.waitKey(1)
                 if self.capture_requested and boxes:
                     self.capture_requested = False
-                    full_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    encs.append(face_recognition.face_encodings(full_rgb)[0])
-                    cv2.imwrite(f"{IMAGES_DIR}/{current_user}_{steps[idx]}.jpg", frame)
+                    encs.append(encode_faces(res.frame, boxes[:1])[0])
+                    cv2.imwrite(f"{IMAGES_DIR}/{current_user}_{steps[idx]}.jpg", res.frame)
                     idx += 1; cv2.waitKey(200)
                 if key == 27: break
-            except: continue
-        cap.release(); cv2.destroyAllWindows()
+            except Exception as e: METRICS.error("display.failed", e); continue
+        pipe.stop(); cv2.destroyAllWindows()
         if len(encs)==3: self.capture_queue.put(("success", np.mean(encs, axis=0)))
         else: self.capture_queue.put(("cancel", None))
 
@@ -202,12 +240,105 @@ class RegistrationFrame(tk.Frame):
         try:
             msg = self.capture_queue.get_nowait()
             if msg[0] == "success":
-                conn = sqlite3.connect(DB_NAME); conn.cursor().execute("UPDATE students SET face_encoding=?, is_face_registered=1 WHERE student_id=?", (pickle.dumps(msg[1]), current_user)); conn.commit(); conn.close()
+                DB.save_encoding(current_user, msg[1])
+                GALLERY.upsert(current_user, msg[1])
                 messagebox.showinfo("Done", "Registered!"); self.controller.show_frame(StudentDashboard)
             elif msg[0] == "error": messagebox.showerror("Error", msg[1])
             self.btn_start.config(state="normal"); self.btn_capture.config(state="disabled")
         except: self.after(100, self.check_queue)
 
+# --- قائمة افتراضية ---
+# صفوف بارتفاع ثابت، والـ widgets تُنشأ للصفوف الظاهرة فقط ثم يُعاد استخدامها عند التمرير.
+# set_items/update_item لا تعيد رسم إلا الصفوف الظاهرة التي تغيرت بياناتها.
+class VirtualList(tk.Frame):
+    def __init__(self, parent, row_height, make_row, bind_row, bg=BG_COLOR):
+        super().__init__(parent, bg=bg)
+        self.row_height = row_height; self.make_row = make_row; self.bind_row = bind_row
+        self.canvas = tk.Canvas(self, bg=bg, highlightthickness=0, yscrollincrement=row_height)
+        scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+        self.canvas.pack(side="left", fill="both", expand=True); scrollbar.pack(side="right", fill="y")
+        self.keys = []; self.data = {}
+        self.pool = [] # [row, window_id, key, data]
+        self.width = 0
+        self.canvas.bind("<Configure>", lambda e: self.render())
+        self.canvas.bind("<Enter>", self._bind_wheel); self.canvas.bind("<Leave>", self._unbind_wheel)
+
+    def _bind_wheel(self, e):
+        self.canvas.bind_all("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1))
+        self.canvas.bind_all("<Button-4>", lambda e: self.scroll(-1)); self.canvas.bind_all("<Button-5>", lambda e: self.scroll(1))
+
+    def _unbind_wheel(self, e):
+        for seq in ("<MouseWheel>", "<Button-4>", "<Button-5>"): self.canvas.unbind_all(seq)
+
+    def yview(self, *args): self.canvas.yview(*args); self.render()
+    def scroll(self, rows): self.canvas.yview_scroll(rows * 3, "units"); self.render()
+
+    def set_items(self, items):
+        """items: [(key, data)] بالترتيب. الصفوف التي لم تتغير بياناتها لا تُلمس."""
+        self.keys = [k for k, _ in items]; self.data = dict(items)
+        self.canvas.configure(scrollregion=(0, 0, 0, len(self.keys) * self.row_height))
+        if self.canvas.canvasy(0) >= len(self.keys) * self.row_height: self.canvas.yview_moveto(0)
+        self.render()
+
+    def update_item(self, key, data):
+        if key not in self.data: return
+        self.data[key] = data; self.render()
+
+    def render(self):
+        height = self.canvas.winfo_height(); width = self.canvas.winfo_width()
+        if height <= 1: return
+        rh = self.row_height
+        top = max(0, int(self.canvas.canvasy(0)) // rh)
+        visible = self.keys[top:top + height // rh + 2]
+        while len(self.pool) < len(visible):
+            row = self.make_row(self.canvas)
+            self.pool.append([row, self.canvas.create_window(0, 0, window=row, anchor="nw", height=rh, width=width), None, None])
+        resized = width != self.width; self.width = width
+        for i, slot in enumerate(self.pool):
+            if i >= len(visible):
+                # خارج المنطقة المرئية (فوق scrollregion)
+                if slot[2] is not None: self.canvas.coords(slot[1], 0, -2 * rh); slot[2] = slot[3] = None
+                continue
+            key = visible[i]; data = self.data[key]
+            self.canvas.coords(slot[1], 0, (top + i) * rh)
+            if resized: self.canvas.itemconfig(slot[1], width=width)
+            if slot[2] != key or slot[3] != data:
+                self.bind_row(slot[0], key, data); slot[2] = key; slot[3] = data
+
+# صف جدول قابل لإعادة الاستخدام: عنوان يوم أو مادة
+class ScheduleRow(tk.Frame):
+    def __init__(self, parent):
+        super().__init__(parent, bg="white", highlightthickness=1, highlightbackground="#eee")
+        self.key = None; self.kind = None
+        self.header = tk.Label(self, font=("Arial", 12, "bold"), fg="white", padx=10, anchor="w")
+        self.body = tk.Frame(self, bg="white", padx=10)
+        info = tk.Frame(self.body, bg="white"); info.pack(side="left", fill="x", expand=True)
+        self.title = tk.Label(info, font=("Arial", 12, "bold"), bg="white"); self.title.pack(anchor="w")
+        self.info = tk.Label(info, font=("Arial", 10), bg="white", fg="gray"); self.info.pack(anchor="w")
+
+    def show(self, kind):
+        if kind == self.kind: return
+        (self.body if kind == "header" else self.header).pack_forget()
+        (self.header if kind == "header" else self.body).pack(fill="both", expand=True)
+        self.kind = kind
+
+    def set_header(self, day, color):
+        self.show("header"); self.header.config(text=day, bg=color)
+
+    def set_subject(self, sub, at, room):
+        self.show("subject"); self.title.config(text=sub); self.info.config(text=f"⏰ {at} | 📍 {room}")
+
+def schedule_items(rows, subject_data):
+    # [(day, sub, at, room)] مرتبة من قاعدة البيانات -> عنوان لكل يوم ثم مواده
+    items = []; day = None
+    for d, sub, at, room in rows:
+        if d != day: day = d; items.append((("day", d), ("header", d)))
+        items.append(((d, sub, at), ("subject", sub, at, room) + subject_data(sub)))
+    return items
+
+ROW_HEIGHT = 56
+
 # --- Teacher Dashboard ---
 class TeacherDashboard(tk.Frame):
     def __init__(self, parent, controller):
@@ -215,72 +346,91 @@ class TeacherDashboard(tk.Frame):
         header = tk.Frame(self, bg=PRIMARY_COLOR, padx=20, pady=15); header.pack(fill="x")
         self.lbl_welcome = tk.Label(header, text="Instructor Dashboard", font=("Arial", 14, "bold"), bg=PRIMARY_COLOR, fg="white"); self.lbl_welcome.pack(side="left")
         tk.Button(header, text="Logout", bg="#c0392b", fg="white", bd=0, padx=10, command=lambda: controller.show_frame(LoginFrame)).pack(side="right")
-        
-        # Scrollable Area (Fixed Width Issue)
-        canvas = tk.Canvas(self, bg=BG_COLOR, highlightthickness=0)
-        scrollbar = ttk.Scrollbar(self, orient="vertical", command=canvas.yview)
-        self.scrollable_frame = tk.Frame(canvas, bg=BG_COLOR)
-        
-        # --- (تصحيح المشكلة 2: إجبار الإطار الداخلي على أخذ عرض الشاشة) ---
-        self.window_id = canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
-        canvas.bind('<Configure>', lambda e: canvas.itemconfig(self.window_id, width=e.width))
-        
-        self.scrollable_frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-        canvas.configure(yscrollcommand=scrollbar.set)
-        canvas.pack(side="left", fill="both", expand=True, padx=10, pady=10)
-        scrollbar.pack(side="right", fill="y")
-        self.ui_elements = {}
+
+        # الحاضرون الآن في المادة المختارة
+        side = tk.Frame(self, bg="white", width=280, bd=1, relief="solid"); side.pack(side="right", fill="y", padx=(0, 10), pady=10); side.pack_propagate(False)
+        self.lbl_roster = tk.Label(side, text="Select a subject", font=("Arial", 11, "bold"), bg="#444", fg="white", padx=10, pady=5, anchor="w"); self.lbl_roster.pack(fill="x")
+        self.roster = VirtualList(side, 24, lambda p: tk.Label(p, bg="white", font=FONT_NORMAL, anchor="w", padx=10),
+                                  lambda lbl, key, data: lbl.config(text=data), bg="white")
+        self.roster.pack(fill="both", expand=True)
+
+        self.list = VirtualList(self, ROW_HEIGHT, self.make_row, self.bind_row)
+        self.list.pack(side="left", fill="both", expand=True, padx=10, pady=10)
+        self.controller = controller
+        self.rows_by_subject = {}; self.day = None; self.roster_subject = None; self._poll_id = None
+        BUS.subscribe(TOPIC_SESSION, self.on_change); BUS.subscribe(TOPIC_ATTENDANCE, self.on_change)
+
+    def make_row(self, parent):
+        row = ScheduleRow(parent)
+        stats = tk.Frame(row.body, bg="white"); stats.pack(side="left", padx=20)
+        row.st = tk.Label(stats, font=("Arial", 10, "bold"), bg="white"); row.st.pack()
+        row.cnt = tk.Label(stats, font=("Arial", 10), bg="white"); row.cnt.pack()
+        row.btn = tk.Button(row.body, fg="white", bd=0, padx=10, width=6, command=lambda: self.toggle(row.key[1])); row.btn.pack(side="right")
+        tk.Button(row.body, text="Roster", bg="#7f8c8d", fg="white", bd=0, padx=10, command=lambda: self.show_roster(row.key[1])).pack(side="right", padx=5)
+        return row
+
+    def bind_row(self, row, key, data):
+        row.key = key
+        if data[0] == "header": row.set_header(data[1], "#444"); return
+        _, sub, at, room, active, cnt = data
+        row.set_subject(sub, at, room); row.title.config(fg=PRIMARY_COLOR)
+        row.st.config(text="● OPEN" if active else "● CLOSED", fg=ACCENT_COLOR if active else "gray")
+        row.btn.config(text="Close" if active else "Open", bg=ERROR_COLOR if active else ACCENT_COLOR)
+        row.cnt.config(text=f"Present: {cnt}")
 
     def on_show(self):
         self.lbl_welcome.config(text=f"Instructor: {current_user}")
-        for w in self.scrollable_frame.winfo_children(): w.destroy()
-        self.ui_elements = {}
-        
-        for day, subs in WEEKLY_SCHEDULE.items():
-            my_subjects = [s for s in subs if SUBJECT_INSTRUCTORS.get(s[0]) == current_user]
-            if not my_subjects: continue
-            
-            day_frame = tk.Frame(self.scrollable_frame, bg="white", bd=1, relief="solid"); day_frame.pack(fill="x", pady=10, padx=5)
-            tk.Label(day_frame, text=day, font=("Arial", 12, "bold"), bg="#444", fg="white", padx=10, pady=5, anchor="w").pack(fill="x")
-            
-            for sub in my_subjects:
-                row = tk.Frame(day_frame, bg="white", padx=10, pady=10); row.pack(fill="x", pady=1)
-                
-                info = tk.Frame(row, bg="white"); info.pack(side="left", fill="x", expand=True)
-                tk.Label(info, text=sub[0], font=("Arial", 12, "bold"), bg="white", fg=PRIMARY_COLOR).pack(anchor="w")
-                tk.Label(info, text=f"⏰ {sub[1]} | 📍 {sub[2]}", font=("Arial", 10), bg="white", fg="gray").pack(anchor="w")
-                
-                stats = tk.Frame(row, bg="white"); stats.pack(side="left", padx=20)
-                lbl_st = tk.Label(stats, text="Closed", font=("Arial", 10, "bold"), bg="white", fg=ERROR_COLOR); lbl_st.pack()
-                lbl_cnt = tk.Label(stats, text="Count: 0", font=("Arial", 10), bg="white"); lbl_cnt.pack()
-                
-                btn = tk.Button(row, text="Open", bg=ACCENT_COLOR, fg="white", bd=0, padx=10, command=lambda s=sub[0]: self.toggle(s)); btn.pack(side="right")
-                self.ui_elements[sub[0]] = {'st': lbl_st, 'cnt': lbl_cnt, 'btn': btn}
-                tk.Frame(day_frame, bg="#eee", height=1).pack(fill="x")
-        self.update_live()
+        self.schedule = DB.schedule(current_user)
+        self.rows_by_subject = {}
+        for day, sub, at, room in self.schedule: self.rows_by_subject.setdefault(sub, []).append(((day, sub, at), room))
+        if self.roster_subject not in self.rows_by_subject: self.roster_subject = None; self.lbl_roster.config(text="Select a subject"); self.roster.set_items([])
+        self.refresh_all(); self.schedule_poll()
+
+    def on_hide(self):
+        if self._poll_id: self.after_cancel(self._poll_id); self._poll_id = None
+
+    @property
+    def active(self): return self.controller.current is self
+
+    def schedule_poll(self):
+        # سلسلة after واحدة فقط مهما تكرر الدخول
+        if self._poll_id: self.after_cancel(self._poll_id)
+        self._poll_id = self.after(CHANGE_POLL_MS, self.update_live)
 
     def toggle(self, sub):
-        conn = sqlite3.connect(DB_NAME); c = conn.cursor()
-        curr = c.execute("SELECT is_active FROM sessions WHERE subject_name=?", (sub,)).fetchone()
-        new = 1 if curr and curr[0]==0 else 0
-        c.execute("UPDATE sessions SET is_active=? WHERE subject_name=?", (new, sub)); conn.commit(); conn.close()
-        self.update_single(sub)
+        DB.toggle_session(sub)
+        BUS.publish(TOPIC_SESSION, subject=sub)
+
+    def on_change(self, subject, **_):
+        # يحدّث صفوف المادة التي تغيرت فقط
+        if subject in self.rows_by_subject and self.active: self.update_single(subject)
 
     def update_live(self):
-        if not self.winfo_ismapped(): return
-        for sub in self.ui_elements: self.update_single(sub)
-        self.after(3000, self.update_live)
+        self._poll_id = None
+        if not self.active: return
+        if self.day != datetime.now().strftime('%Y-%m-%d'): self.refresh_all()
+        else: FEED.poll()
+        self.schedule_poll()
+
+    def refresh_all(self):
+        self.day = datetime.now().strftime('%Y-%m-%d')
+        states = DB.dashboard_states(self.day, current_user)
+        self.list.set_items(schedule_items(self.schedule, lambda sub: states.get(sub, (False, 0))))
+        self.load_roster()
 
     def update_single(self, sub):
-        conn = sqlite3.connect(DB_NAME); c = conn.cursor()
-        active = c.execute("SELECT is_active FROM sessions WHERE subject_name=?", (sub,)).fetchone()
-        active = active[0] if active else 0
-        cnt = c.execute("SELECT COUNT(*) FROM attendance WHERE subject_name=? AND timestamp LIKE ?", (sub, f"{datetime.now().strftime('%Y-%m-%d')}%")).fetchone()[0]
-        conn.close()
-        el = self.ui_elements[sub]
-        el['st'].config(text="● OPEN" if active else "● CLOSED", fg=ACCENT_COLOR if active else "gray")
-        el['btn'].config(text="Close" if active else "Open", bg=ERROR_COLOR if active else ACCENT_COLOR)
-        el['cnt'].config(text=f"Present: {cnt}")
+        state = (DB.session_active(sub), DB.attendance_count(sub, self.day))
+        for key, room in self.rows_by_subject[sub]: self.list.update_item(key, ("subject", sub, key[2], room) + state)
+        if sub == self.roster_subject: self.load_roster()
+
+    def show_roster(self, sub):
+        self.roster_subject = sub; self.load_roster()
+
+    def load_roster(self):
+        if self.roster_subject is None: return
+        rows = DB.roster(self.roster_subject, self.day)
+        self.lbl_roster.config(text=f"{self.roster_subject}: {len(rows)} present")
+        self.roster.set_items([(sid, f"{sid}  {name or ''}") for sid, name in rows])
 
 # --- Student Dashboard ---
 class StudentDashboard(tk.Frame):
@@ -291,70 +441,83 @@ class StudentDashboard(tk.Frame):
         header = tk.Frame(self, bg=PRIMARY_COLOR, padx=20, pady=15); header.pack(fill="x")
         self.lbl_welcome = tk.Label(header, text="Welcome", font=("Arial", 14, "bold"), bg=PRIMARY_COLOR, fg="white"); self.lbl_welcome.pack(side="left")
         tk.Button(header, text="Logout", bg="#c0392b", fg="white", bd=0, padx=10, command=lambda: controller.show_frame(LoginFrame)).pack(side="right")
-        
-        canvas = tk.Canvas(self, bg=BG_COLOR, highlightthickness=0)
-        scrollbar = ttk.Scrollbar(self, orient="vertical", command=canvas.yview)
-        self.scrollable_frame = tk.Frame(canvas, bg=BG_COLOR)
-        
-        # --- (تصحيح المشكلة 2: إجبار الإطار الداخلي على أخذ عرض الشاشة) ---
-        self.window_id = canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
-        canvas.bind('<Configure>', lambda e: canvas.itemconfig(self.window_id, width=e.width))
-        
-        self.scrollable_frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-        canvas.configure(yscrollcommand=scrollbar.set)
-        canvas.pack(side="left", fill="both", expand=True, padx=10, pady=10)
-        scrollbar.pack(side="right", fill="y")
-
-        for day, subs in WEEKLY_SCHEDULE.items():
-            day_cont = tk.Frame(self.scrollable_frame, bg="white", bd=1, relief="solid"); day_cont.pack(fill="x", pady=10, padx=5)
-            tk.Label(day_cont, text=day, font=("Arial", 12, "bold"), bg=PRIMARY_COLOR, fg="white", pady=5, padx=10, anchor="w").pack(fill="x")
-            for sub in subs:
-                row = tk.Frame(day_cont, bg="white", padx=10, pady=10); row.pack(fill="x", pady=1)
-                info = tk.Frame(row, bg="white"); info.pack(side="left", fill="x", expand=True)
-                tk.Label(info, text=sub[0], font=("Arial", 12, "bold"), bg="white", fg="#333").pack(anchor="w")
-                tk.Label(info, text=f"⏰ {sub[1]} | 📍 {sub[2]}", font=("Arial", 10), bg="white", fg="gray").pack(anchor="w")
-                tk.Button(row, text="Mark Attendance", bg=ACCENT_COLOR, fg="white", bd=0, padx=15, pady=5, command=lambda s=sub[0]: self.start_verify(s)).pack(side="right")
-                tk.Frame(day_cont, bg="#eee", height=1).pack(fill="x")
-
-    def on_show(self): self.lbl_welcome.config(text=f"Student ID: {current_user}")
+        self.list = VirtualList(self, ROW_HEIGHT, self.make_row, self.bind_row)
+        self.list.pack(fill="both", expand=True, padx=10, pady=10)
+
+    def make_row(self, parent):
+        row = ScheduleRow(parent); row.title.config(fg="#333")
+        tk.Button(row.body, text="Mark Attendance", bg=ACCENT_COLOR, fg="white", bd=0, padx=15, pady=5, command=lambda: self.start_verify(row.key[1])).pack(side="right")
+        return row
+
+    def bind_row(self, row, key, data):
+        row.key = key
+        if data[0] == "header": row.set_header(data[1], PRIMARY_COLOR)
+        else: row.set_subject(*data[1:4])
+
+    def on_show(self):
+        self.lbl_welcome.config(text=f"Student ID: {current_user}")
+        self.list.set_items(schedule_items(DB.schedule(), lambda sub: ()))
     def start_verify(self, sub): threading.Thread(target=self.run_verify, args=(sub,), daemon=True).start(); self.check_queue()
     def run_verify(self, sub):
-        conn = sqlite3.connect(DB_NAME); c = conn.cursor()
-        active = c.execute("SELECT is_active FROM sessions WHERE subject_name=?", (sub,)).fetchone()
-        if not active or active[0]==0: conn.close(); self.verify_queue.put(("error", "Closed")); return
-        enc = pickle.loads(c.execute("SELECT face_encoding FROM students WHERE student_id=?", (current_user,)).fetchone()[0]); conn.close()
-        cap = cv2.VideoCapture(0, cv2.CAP_DSHOW); found = False; start = time.time()
-        while time.time()-start < 8:
-            ret, frame = cap.read()
-            if not ret: break
-            try:
-                frame = np.ascontiguousarray(frame.astype(np.uint8))
-                rgb = cv2.cvtColor(cv2.resize(frame, (0,0), fx=0.5, fy=0.5), cv2.COLOR_BGR2RGB)
-                boxes = face_recognition.face_locations(rgb)
-                color = (0, 0, 255); txt = "Scanning..."
-                if boxes:
-                    match = face_recognition.compare_faces([enc], face_recognition.face_encodings(rgb, boxes)[0], 0.5)
-                    if match[0]:
-                        color = (0, 255, 0); txt = "MATCHED!"; found = True
-                        t,r,b,l = boxes[0]; cv2.rectangle(frame, (l*2, t*2), (r*2, b*2), color, 3)
-                        cv2.putText(frame, txt, (30,50), 4, 1, color, 2); cv2.imshow("Verify", frame); cv2.waitKey(1000); break
-                cv2.putText(frame, txt, (30,50), 4, 1, color, 2); cv2.imshow("Verify", frame)
-                if cv2.waitKey(30)==27: break
-            except: continue
-        cap.release(); cv2.destroyAllWindows()
+        # thread جديد لكل محاولة، فاتصاله بالقاعدة يُغلق معه
+        try: self.verify(sub)
+        finally: DB.release()
+
+    def verify(self, sub):
+        if not DB.session_active(sub): self.verify_queue.put(("error", "Closed")); return
+        if wait_for_vision(): self.verify_queue.put(("error", "Camera modules failed to load")); return
+        if current_user not in GALLERY:
+            try: enc = DB.get_encoding(current_user)
+            except ValueError: enc = None # بصمة تالفة أو بصيغة غير معروفة
+            if enc is None: self.verify_queue.put(("error", "Face not registered")); return
+            GALLERY.upsert(current_user, enc)
+        # المطابقة في thread الكشف مع كل بصمة جديدة، والعرض هنا لا ينتظرها
+        matched = threading.Event()
+        def on_result(res):
+            if any(GALLERY.verify(current_user, res.encodings[i], MATCH_THRESHOLD) for i in res.fresh): matched.set()
+        pipe = FacePipeline(CAMERA_INDEX, on_result=on_result, detect_stride=DETECT_STRIDE); found = False
+        if pipe.start():
+            start = time.time()
+            while time.time()-start < 8 and pipe.running:
+                item, res = pipe.next_frame()
+                if item is None: continue
+                try:
+                    frame = item[1].copy(); found = matched.is_set()
+                    color = (0, 255, 0) if found else (0, 0, 255); txt = "MATCHED!" if found else "Scanning..."
+                    if found and res and res.boxes:
+                        t,r,b,l = res.boxes[0]; cv2.rectangle(frame, (l, t), (r, b), color, 3)
+                    cv2.putText(frame, txt, (30,50), 4, 1, color, 2)
+                    if found: cv2.imshow("Verify", frame); cv2.waitKey(1000); break
+                    with METRICS.timer("display.show"): cv2.imshow("Verify", frame); key = cv2.waitKey(1)
+                    if key==27: break
+                except Exception as e: METRICS.error("display.failed", e); continue
+        pipe.stop(); cv2.destroyAllWindows()
         self.verify_queue.put(("success", sub) if found else ("error", "Failed"))
 
     def check_queue(self):
         try:
             msg = self.verify_queue.get_nowait()
             if msg[0]=="success":
-                try:
-                    conn = sqlite3.connect(DB_NAME); conn.cursor().execute("INSERT INTO attendance VALUES (?, ?, ?)", (current_user, msg[1], datetime.now().strftime("%Y-%m-%d"))); conn.commit(); conn.close()
-                    messagebox.showinfo("Success", "Marked!")
-                except: messagebox.showwarning("Info", "Already marked")
+                self.show_mark(RECORDER.mark(current_user, msg[1], datetime.now().strftime("%Y-%m-%d")), msg[1])
             else: messagebox.showerror("Error", msg[1])
         except: self.after(100, self.check_queue)
 
+    def show_mark(self, fut, sub):
+        # الكتابة تتم على دفعات في thread الكاتب، ننتظر النتيجة بدون تجميد الواجهة
+        if not fut.done(): self.after(20, self.show_mark, fut, sub); return
+        try: new = fut.result()
+        except Exception as e: messagebox.showerror("Error", f"DB Error: {e}"); return
+        if new: BUS.publish(TOPIC_ATTENDANCE, subject=sub); messagebox.showinfo("Success", "Marked!")
+        else: messagebox.showwarning("Info", "Already marked")
+
 if __name__ == "__main__":
+    METRICS.enabled = bool(METRICS_LOG or STATS_PANEL)
+    reporter = JsonlReporter(METRICS, METRICS_LOG, METRICS_INTERVAL) if METRICS_LOG else None
+    if reporter: reporter.start()
+    threading.Thread(target=warm_up, daemon=True).start()
     app = SmartAttendanceApp()
-    app.mainloop()
\ No newline at end of file
+    if STATS_PANEL: app.bind("<F12>", lambda e: StatsPanel(app))
+    app.update_idletasks(); log_startup("login_shown")
+    app.mainloop()
+    RECORDER.close(); DB.close()
+    if reporter: reporter.stop()
\ No newline at end of file
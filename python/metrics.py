@@ -0,0 +1,125 @@
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+# --- قياس زمن المراحل ---
+# مؤقتات وعدادات حول الالتقاط والكشف والتشفير والمطابقة وقاعدة البيانات.
+# الهستوغرام بخانات لوغاريتمية (دقة ~5%) فالذاكرة ثابتة مهما طال التشغيل.
+# عند التعطيل (الافتراضي) timer() يرجع context فارغ ثابت، فالتكلفة شبه معدومة.
+
+_BASE = 1.05
+_MIN = 0.001   # أصغر قيمة لها خانة خاصة (ms)
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = {}; self.count = 0; self.total = 0.0; self.max = 0.0
+
+    def add(self, v):
+        i = 0 if v <= _MIN else int(math.log(v / _MIN, _BASE)) + 1
+        self.buckets[i] = self.buckets.get(i, 0) + 1
+        self.count += 1; self.total += v
+        if v > self.max: self.max = v
+
+    def merge(self, other):
+        for i, n in other.buckets.items(): self.buckets[i] = self.buckets.get(i, 0) + n
+        self.count += other.count; self.total += other.total; self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        if not self.count: return 0.0
+        rank = q * self.count; seen = 0
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if seen >= rank: return min(self.max, _MIN * _BASE ** i)
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "mean": round(self.total / self.count, 3) if self.count else 0.0,
+                "p50": round(self.percentile(0.50), 3), "p95": round(self.percentile(0.95), 3),
+                "p99": round(self.percentile(0.99), 3), "max": round(self.max, 3)}
+
+
+class _NullTimer:
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+
+_NULL = _NullTimer()
+
+
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._hist = {}; self._counters = {}
+        self.last_errors = {}
+
+    def timer(self, name):
+        """with METRICS.timer("vision.detect"): ... يسجل الزمن بالـ ms في name_ms."""
+        return self._timer(name) if self.enabled else _NULL
+
+    @contextmanager
+    def _timer(self, name):
+        t = time.perf_counter()
+        try: yield
+        finally: self.observe(name + "_ms", (time.perf_counter() - t) * 1000.0)
+
+    def timed(self, name):
+        def deco(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled: return fn(*args, **kwargs)
+                with self._timer(name): return fn(*args, **kwargs)
+            return wrapper
+        return deco
+
+    def observe(self, name, value):
+        if not self.enabled: return
+        with self._lock:
+            h = self._hist.get(name)
+            if h is None: h = self._hist[name] = Histogram()
+            h.add(value)
+
+    def incr(self, name, n=1):
+        if not self.enabled: return
+        with self._lock: self._counters[name] = self._counters.get(name, 0) + n
+
+    def error(self, name, exc):
+        # يُعد حتى والقياس معطل (الأخطاء نادرة فالتكلفة لا تُذكر)، والرسالة الأخيرة فقط (لا نطبع خطأ كل إطار)
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+            self.last_errors[name] = f"{type(exc).__name__}: {exc}"
+
+    def snapshot(self):
+        with self._lock:
+            return {"timers": {k: h.summary() for k, h in sorted(self._hist.items())},
+                    "counters": dict(sorted(self._counters.items())), "errors": dict(self.last_errors)}
+
+    def reset(self):
+        with self._lock: self._hist.clear(); self._counters.clear(); self.last_errors.clear()
+
+
+class JsonlReporter(threading.Thread):
+    def __init__(self, metrics, path, interval=10.0):
+        super().__init__(daemon=True)
+        self.metrics = metrics; self.path = path; self.interval = interval
+        self._halt = threading.Event()
+
+    def run(self):
+        while not self._halt.wait(self.interval): self.write()
+
+    def write(self):
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"at": datetime.now().isoformat(timespec="seconds"), **self.metrics.snapshot()}) + "\n")
+        except OSError as e: print(f"Metrics log error: {e}")
+
+    def stop(self):
+        self._halt.set(); self.write()
+
+
+METRICS = Metrics()
@@ -0,0 +1,224 @@
+import os
+import threading
+import time
+from collections import namedtuple
+import cv2
+import numpy as np
+from detection import FaceDetector, encode_faces
+from metrics import METRICS
+
+# --- خط معالجة الكاميرا ---
+# ثلاث مراحل منفصلة: التقاط (thread) -> كشف وتشفير (thread) -> عرض (thread المستدعي).
+# بينها مخازن بحجم إطار واحد "الأحدث يفوز"، فبطء face_locations لا يجمّد العرض
+# والكشف يعمل دائماً على آخر إطار بدل طابور متأخر.
+
+DETECT_STRIDE = 2
+RECONNECT_MIN = 1.0   # ثوانٍ قبل أول إعادة اتصال ببث مباشر، وتتضاعف حتى RECONNECT_MAX
+RECONNECT_MAX = 30.0
+READ_RETRIES = 10     # قراءات فاشلة متتالية من كاميرا USB قبل إعادة فتحها (كاميرا فُصلت)
+
+PipelineResult = namedtuple("PipelineResult", "frame_id frame boxes encodings fresh")
+
+
+class LatestFrame:
+    def __init__(self, name="frames"):
+        self.name = name
+        self._cond = threading.Condition()
+        self._item = None; self._seq = 0; self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None: self.dropped += 1; METRICS.incr(f"{self.name}.dropped")
+            self._item = item; self._seq += 1
+            self._cond.notify_all()
+
+    def get(self, last_seq=0, timeout=None):
+        """ينتظر إطاراً أحدث من last_seq ويرجع (seq, item)، أو (last_seq, None) عند الإغلاق/انتهاء المهلة."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > last_seq or self._closed, timeout): return last_seq, None
+            if self._seq <= last_seq: return last_seq, None
+            item, self._item = self._item, None
+            return self._seq, item
+
+    def close(self):
+        with self._cond: self._closed = True; self._cond.notify_all()
+
+    @property
+    def closed(self): return self._closed
+
+
+def is_live(source):
+    # رقم = كاميرا، نص ليس ملفاً موجوداً = بث (rtsp/http)؛ الملفات فقط تنتهي
+    return isinstance(source, int) or not os.path.isfile(source)
+
+
+def open_capture(source):
+    # رقم = كاميرا (DirectShow على ويندوز)، نص = ملف فيديو أو رابط بث
+    if isinstance(source, int): return cv2.VideoCapture(source, cv2.CAP_DSHOW)
+    return cv2.VideoCapture(source)
+
+
+class CaptureThread(threading.Thread):
+    def __init__(self, source, outputs, pace=True):
+        super().__init__(daemon=True)
+        self.source = source; self.outputs = outputs; self.pace = pace
+        self.opened = threading.Event(); self.failed = False
+        self._halt = threading.Event()
+        self.frames = 0
+
+    def run(self):
+        cap = open_capture(self.source)
+        if not cap.isOpened(): self.failed = True; self.opened.set(); self._close(); return
+        self.opened.set()
+        live = is_live(self.source)
+        # ملفات الفيديو تُقرأ بسرعتها الطبيعية حتى تتصرف مثل الكاميرا
+        fps = cap.get(cv2.CAP_PROP_FPS) if self.pace and not live else 0
+        delay = 1.0 / fps if fps and fps > 0 else 0; next_t = time.perf_counter()
+        fails = 0
+        try:
+            while not self._halt.is_set():
+                with METRICS.timer("capture.read"): ret, frame = cap.read()
+                if not ret:
+                    if not live: break
+                    fails += 1; METRICS.incr("capture.failed")
+                    # الكاميرا قد تفشل في قراءة عابرة: انتظار قصير بدل حلقة تستهلك نواة كاملة
+                    if isinstance(self.source, int) and fails < READ_RETRIES:
+                        self._halt.wait(0.05 * fails); continue
+                    # كاميرا فُصلت أو انقطع البث: إعادة الفتح بدل إيقاف القاعة لبقية اليوم
+                    cap = self._reconnect(cap); fails = 0
+                    if cap is None: break
+                    next_t = time.perf_counter(); continue
+                fails = 0
+                self.frames += 1; METRICS.incr("capture.frames")
+                item = (self.frames, np.ascontiguousarray(frame, dtype=np.uint8))
+                for out in self.outputs: out.put(item)
+                if delay:
+                    next_t += delay; time.sleep(max(0.0, next_t - time.perf_counter()))
+        finally:
+            if cap is not None: cap.release()
+            self._close()
+
+    def _reconnect(self, cap):
+        cap.release(); delay = RECONNECT_MIN
+        print(f"Capture lost: {self.source}, reconnecting")
+        while not self._halt.wait(delay):
+            METRICS.incr("capture.reconnects")
+            cap = open_capture(self.source)
+            if cap.isOpened(): return cap
+            cap.release(); delay = min(delay * 2, RECONNECT_MAX)
+        return None
+
+    def _close(self):
+        for out in self.outputs: out.close()
+
+    def stop(self): self._halt.set()
+
+
+def _iou(a, b):
+    t, r, bt, l = a; t2, r2, b2, l2 = b
+    w = min(r, r2) - max(l, l2); h = min(bt, b2) - max(t, t2)
+    if w <= 0 or h <= 0: return 0.0
+    inter = w * h
+    return inter / float((r - l) * (bt - t) + (r2 - l2) * (b2 - t2) - inter)
+
+
+class FaceTracker:
+    """يربط الوجوه بين الكشوفات المتتالية بالتداخل (IoU)، فيُعاد التشفير فقط
+    لوجه جديد أو وجه تحرك، أو بعد refresh كشوفات لتحسين البصمة."""
+
+    def __init__(self, iou_threshold=0.6, refresh=5):
+        self.iou_threshold = iou_threshold; self.refresh = refresh
+        self.tracks = []  # [box, encoding, age]
+
+    def update(self, boxes):
+        tracks = []; fresh = []
+        unused = list(self.tracks)
+        for i, box in enumerate(boxes):
+            best = max(unused, key=lambda tr: _iou(tr[0], box), default=None)
+            if best is not None and _iou(best[0], box) >= self.iou_threshold and best[2] < self.refresh:
+                unused.remove(best)
+                # الوجه لم يتحرك: نحتفظ بالصندوق القديم حتى تبقى المقارنة مع نقطة ثابتة
+                tracks.append([best[0], best[1], best[2] + 1])
+            else:
+                tracks.append([box, None, 0]); fresh.append(i)
+        self.tracks = tracks
+        return fresh
+
+    def set_encodings(self, indices, encodings):
+        for i, enc in zip(indices, encodings): self.tracks[i][1] = enc
+
+    def reset(self): self.tracks = []
+
+
+class VisionWorker(threading.Thread):
+    def __init__(self, source_buf, detect, encode, on_result=None, detect_stride=DETECT_STRIDE):
+        super().__init__(daemon=True)
+        self.source_buf = source_buf; self.detect = detect; self.encode = encode
+        self.on_result = on_result; self.detect_stride = max(1, detect_stride)
+        self.tracker = FaceTracker()
+        self.latest = None; self.boxes = []
+        self.errors = 0; self.processed = 0
+        self._halt = threading.Event()
+
+    def process(self, frame):
+        """خطوة الكشف لإطار واحد (يستدعيها run وbench.py). ترجع فهارس الوجوه الجديدة، أو None لإطار بدون كشف."""
+        if self.processed % self.detect_stride:
+            self.processed += 1; METRICS.incr("vision.skipped")
+            return None
+        with METRICS.timer("vision.detect"): boxes = self.detect(frame)
+        fresh = self.tracker.update(boxes)
+        if fresh and self.encode:
+            with METRICS.timer("vision.encode"): self.tracker.set_encodings(fresh, self.encode(frame, [boxes[i] for i in fresh]))
+        self.boxes = boxes; self.processed += 1
+        return fresh
+
+    def run(self):
+        seq = 0
+        while not self._halt.is_set():
+            seq, item = self.source_buf.get(seq, timeout=0.5)
+            if item is None:
+                if self.source_buf.closed: break
+                continue
+            frame_id, frame = item; t0 = time.perf_counter()
+            try: fresh = self.process(frame)
+            except Exception as e:
+                self.errors += 1; METRICS.error("vision.failed", e)
+                if self.errors == 1: print(f"Vision error: {e}")
+                continue
+            if METRICS.enabled: METRICS.observe("vision.latency_ms", (time.perf_counter() - t0) * 1000.0)
+            # إطار بدون كشف لا يُنشر: النتيجة تبقى إطار الكشف مع صناديقه، فالتشفير/الحفظ
+            # من res.frame لا يقرن إطاراً جديداً بصناديق من إطار أقدم
+            if fresh is None: continue
+            tracks = self.tracker.tracks
+            res = PipelineResult(frame_id, frame, list(self.boxes), [tr[1] for tr in tracks], fresh)
+            self.latest = res
+            if self.on_result: self.on_result(res)
+
+    def stop(self): self._halt.set()
+
+
+class FacePipeline:
+    def __init__(self, source, detect=None, encode=encode_faces, on_result=None, detect_stride=DETECT_STRIDE, pace=True):
+        self.work_buf = LatestFrame("vision"); self.display_buf = LatestFrame("display")
+        self.capture = CaptureThread(source, [self.work_buf, self.display_buf], pace=pace)
+        # الكاشف له حالة (حركة، أحجام الوجوه الأخيرة) فلكل خط معالجة كاشف خاص
+        self.worker = VisionWorker(self.work_buf, detect or FaceDetector(), encode, on_result, detect_stride)
+        self._display_seq = 0
+
+    def start(self, timeout=5.0):
+        self.capture.start(); self.worker.start()
+        self.capture.opened.wait(timeout)
+        return not self.capture.failed
+
+    def next_frame(self, timeout=0.5):
+        """للعرض: أحدث إطار من الكاميرا (أو None) مع آخر نتيجة كشف."""
+        self._display_seq, item = self.display_buf.get(self._display_seq, timeout)
+        return item, self.worker.latest
+
+    @property
+    def running(self): return not self.display_buf.closed
+
+    def stop(self):
+        self.capture.stop(); self.worker.stop()
+        self.capture.join(2.0); self.worker.join(2.0)
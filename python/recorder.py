@@ -0,0 +1,82 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from db import PROCESS_ID, SQL_LOG_CHANGE, SQL_MARK_ATTENDANCE
+from events import TOPIC_ATTENDANCE
+from metrics import METRICS
+
+# --- كاتب الحضور بالدفعات ---
+# عند فتح محاضرة كبيرة تصل مئات عمليات التسجيل في نفس اللحظة. بدل transaction
+# لكل طالب، تتجمع الطلبات وتُكتب كل flush_interval في transaction واحدة بـ
+# INSERT OR IGNORE، وكل طلب يرجع Future نتيجته True (جديد) أو False (مسجل من قبل).
+
+FLUSH_INTERVAL = 0.0  # 0: الدفعة = كل ما وصل أثناء كتابة الدفعة السابقة (أفضل نتيجة في bench.py db)
+MAX_BATCH = 2000
+PRUNE_EVERY = 500  # دفعات بين كل تنظيف لـ change_log
+
+
+class AttendanceRecorder:
+    def __init__(self, db, flush_interval=FLUSH_INTERVAL, max_batch=MAX_BATCH):
+        self.db = db; self.flush_interval = flush_interval; self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._closed = False; self._lock = threading.Lock()
+        self.batches = 0; self.written = 0
+        self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+        self._thread.start()
+
+    def mark(self, student_id, subject, day):
+        fut = Future()
+        with self._lock:
+            if self._closed: fut.set_exception(RuntimeError("Attendance recorder is closed"))
+            else: self._queue.put((student_id, subject, day, fut))
+        return fut
+
+    def close(self, timeout=10.0):
+        """يكتب ما تبقى في الطابور ثم يثبّت ملف WAL في قاعدة البيانات."""
+        with self._lock:
+            if self._closed: return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None: break
+            batch = [item]
+            # كل ما في الطابور (وما يصل خلال flush_interval إن وُجد) يدخل نفس الـ transaction
+            stop = self._collect(batch)
+            self._flush(batch)
+            if stop: break
+        try: self.db.conn().execute("PRAGMA wal_checkpoint(FULL)")
+        except Exception as e: print(f"Checkpoint error: {e}")
+
+    def _collect(self, batch):
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try: item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty: return False
+            if item is None: return True
+            batch.append(item)
+        return False
+
+    def _flush(self, batch):
+        METRICS.observe("recorder.batch_size", len(batch))
+        try:
+            results = []; changed = set()
+            with METRICS.timer("db.attendance_flush"), self.db.transaction() as conn:
+                for sid, sub, day, _ in batch:
+                    new = conn.execute(SQL_MARK_ATTENDANCE, (sid, sub, day, day)).rowcount == 1
+                    results.append(new)
+                    if new: changed.add(sub)
+                # سطر واحد في change_log لكل مادة تغيرت في الدفعة
+                for sub in changed: conn.execute(SQL_LOG_CHANGE, (TOPIC_ATTENDANCE, sub, PROCESS_ID))
+                if (self.batches + 1) % PRUNE_EVERY == 0: self.db.prune_changes(conn=conn)
+        except Exception as e:
+            METRICS.error("recorder.failed", e)
+            for *_, fut in batch: fut.set_exception(e)
+            return
+        self.batches += 1; self.written += sum(results)
+        for (*_, fut), new in zip(batch, results): fut.set_result(new)
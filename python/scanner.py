@@ -0,0 +1,222 @@
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from db import SCHEMA_VERSION, Database, create_schema
+from detection import FaceDetector, encode_faces
+from events import TOPIC_SESSION, ChangeFeed, EventBus
+from gallery import DEFAULT_THRESHOLD, FaceGallery
+from metrics import METRICS, JsonlReporter
+from pipeline import CaptureThread, VisionWorker, is_live
+from recorder import AttendanceRecorder
+
+# --- خدمة كاميرات القاعات (بدون واجهة) ---
+# كاميرا لكل قاعة، تعمل فقط عندما تكون مادة القاعة اليوم (جدول schedule) مفتوحة (sessions.is_active).
+# كل القاعات تتشارك معرض بصمات واحد في الذاكرة وعدداً محدوداً من threads الكشف،
+# ولكل قاعة آخر إطار فقط (الأحدث يفوز). الطالب يُسجل مرة واحدة لكل مادة في اليوم.
+#
+#   python scanner.py cameras.json --workers 4
+#   cameras.json: {"Room 101": 0, "Lab A": "rtsp://10.0.0.21/stream", "Net Lab": "net_lab.mp4"}
+
+POLL_INTERVAL = 1.0
+GALLERY_REFRESH = 300
+RESTART_DELAY = 10.0  # بث لم يُفتح أصلاً يُعاد تشغيله بعد هذه المدة
+DETECT_STRIDE = 2
+
+
+class RoomStream:
+    """مُخرج لـ CaptureThread: يحتفظ بآخر إطار للقاعة ويضعها في طابور الجاهزين مرة واحدة."""
+
+    def __init__(self, room, subject, source, ready, detect_stride=DETECT_STRIDE):
+        self.room = room; self.subject = subject; self.source = source
+        self.ready = ready
+        self.live = is_live(source); self.started = None
+        # خطوة الكشف نفسها في FacePipeline (بدون thread خاص). بدون بوابة الحركة: وجوه الطلاب في
+        # كاميرا القاعة صغيرة جداً على الصورة المصغرة، والـ cascade يبقى يحمي HOG
+        self.vision = VisionWorker(None, FaceDetector(use_motion=False), encode_faces, detect_stride=detect_stride)
+        self._lock = threading.Lock()
+        self._item = None; self._queued = False; self._closed = False
+        self.frames = 0; self.processed = 0; self.dropped = 0
+        self.capture = CaptureThread(source, [self])
+
+    # --- واجهة مُخرجات CaptureThread ---
+    def put(self, item):
+        with self._lock:
+            if self._item is not None: self.dropped += 1; METRICS.incr("scanner.dropped")
+            self._item = item; self.frames += 1
+            if self._queued: return
+            self._queued = True
+        self.ready.put(self)
+
+    def close(self):
+        with self._lock: self._closed = True
+
+    def take(self):
+        with self._lock:
+            item, self._item = self._item, None
+            if item is None: self._queued = False
+            return item
+
+    def done(self):
+        # إطار جديد وصل أثناء المعالجة: القاعة ترجع لآخر الطابور (عدل بين القاعات)
+        with self._lock:
+            if self._item is None: self._queued = False; return
+        self.ready.put(self)
+
+    @property
+    def finished(self): return self._closed and self._item is None
+
+    @property
+    def dead(self): return self.started is not None and not self.capture.is_alive()
+
+    def start(self): self.started = time.time(); self.capture.start()
+    def stop(self): self.capture.stop()
+
+
+class RoomScanner:
+    def __init__(self, db, cameras, workers=2, threshold=DEFAULT_THRESHOLD, gallery_file=None, day=None, detect_stride=DETECT_STRIDE):
+        self.db = db; self.cameras = cameras; self.threshold = threshold
+        self.gallery_file = gallery_file; self.day_override = day; self.detect_stride = detect_stride
+        self.gallery = FaceGallery().load(db.conn(), gallery_file)
+        self.recorder = AttendanceRecorder(db)
+        self.bus = EventBus(); self.feed = ChangeFeed(db, self.bus)
+        self.bus.subscribe(TOPIC_SESSION, lambda **_: self._dirty.set())
+        self._dirty = threading.Event(); self._dirty.set()
+        self._halt = threading.Event()
+        self.ready = queue.Queue()
+        self.streams = {}
+        self.marked = set(); self._marked_lock = threading.Lock()
+        self.marks = 0
+        self.workers = [threading.Thread(target=self._work, name=f"scanner-{i}", daemon=True) for i in range(max(1, workers))]
+
+    # --- تشغيل/إيقاف الكاميرات حسب الجدول ---
+    def today(self):
+        now = datetime.now()
+        return self.day_override or now.strftime("%A"), now.strftime("%Y-%m-%d")
+
+    def reconcile(self):
+        weekday, date = self.today()
+        states = self.db.dashboard_states(date)
+        wanted = {}
+        for room, subjects in self.db.rooms_for_day(weekday).items():
+            if room not in self.cameras: continue
+            active = [s for s in subjects if states.get(s, (False, 0))[0]]
+            if active: wanted[room] = active[0]
+        for room, stream in list(self.streams.items()):
+            if wanted.get(room) != stream.subject:
+                print(f"[{room}] stop ({stream.subject})"); stream.stop(); del self.streams[room]
+            elif stream.live and stream.dead and time.time() - stream.started >= RESTART_DELAY:
+                # CaptureThread يعيد الاتصال بنفسه، فيتوقف فقط إذا لم يُفتح البث من البداية
+                print(f"[{room}] capture stopped, restarting"); del self.streams[room]
+        for room, subject in wanted.items():
+            if room in self.streams: continue
+            stream = self.streams[room] = RoomStream(room, subject, self.cameras[room], self.ready, self.detect_stride)
+            print(f"[{room}] start ({subject}) <- {self.cameras[room]}"); stream.start()
+
+    # --- threads الكشف المشتركة ---
+    def _work(self):
+        while not self._halt.is_set():
+            try: stream = self.ready.get(timeout=0.5)
+            except queue.Empty: continue
+            item = stream.take()
+            if item is None: continue
+            try: self._process(stream, item[1])
+            except Exception as e: METRICS.error("scanner.failed", e)
+            finally: stream.done()
+
+    def _process(self, stream, frame):
+        # القاعة الواحدة لا تُعالج في threadين معاً (take/done)، فالكاشف والمتتبع بلا قفل
+        stream.processed += 1
+        fresh = stream.vision.process(frame)
+        if not fresh: return
+        tracks = stream.vision.tracker.tracks
+        for i in fresh:
+            top = self.gallery.identify(tracks[i][1], self.threshold, k=1)
+            if top: self._mark(stream, top[0][0], top[0][1])
+
+    def _mark(self, stream, student_id, distance):
+        date = self.today()[1]
+        key = (student_id, stream.subject, date)
+        with self._marked_lock:
+            if key in self.marked: return
+            self.marked.add(key)
+        fut = self.recorder.mark(student_id, stream.subject, date)
+        def report(f, room=stream.room, subject=stream.subject):
+            try: new = f.result()
+            except Exception as e:
+                with self._marked_lock: self.marked.discard(key)
+                print(f"[{room}] {student_id}: DB error {e}"); return
+            if new: self.marks += 1; print(f"[{room}] {student_id} marked for {subject} (distance {distance:.3f})")
+        fut.add_done_callback(report)
+
+    # --- الحلقة الرئيسية ---
+    def run(self, duration=None):
+        for w in self.workers: w.start()
+        start = time.time(); last_gallery = start; day = self.today()
+        try:
+            while not self._halt.is_set():
+                self.feed.poll()
+                if self.today() != day:
+                    day = self.today(); self._dirty.set()
+                    with self._marked_lock: self.marked.clear()
+                if any(s.live and s.dead for s in self.streams.values()): self._dirty.set()
+                if self._dirty.is_set(): self._dirty.clear(); self.reconcile()
+                if time.time() - last_gallery > GALLERY_REFRESH:
+                    # طلاب سُجلوا من الأكشاك بعد بدء الخدمة
+                    self.gallery.load(self.db.conn(), self.gallery_file); last_gallery = time.time()
+                if duration and time.time() - start >= duration: break
+                # كل المصادر ملفات وانتهت (وضع الاختبار)
+                if self.streams and all(not s.live and s.finished and s.dead for s in self.streams.values()) and self.ready.empty(): break
+                time.sleep(POLL_INTERVAL)
+        except KeyboardInterrupt: pass
+        finally: self.stop()
+        return self.marks
+
+    def stop(self):
+        self._halt.set()
+        for s in self.streams.values(): s.stop()
+        for s in self.streams.values(): s.capture.join(2.0)
+        for w in self.workers: w.join(2.0)
+        self.recorder.close()
+
+
+def load_cameras(path):
+    with open(path, encoding="utf-8") as f: cams = json.load(f)
+    # رقم = كاميرا USB، نص = رابط أو ملف فيديو
+    return {room: (int(src) if isinstance(src, str) and src.isdigit() else src) for room, src in cams.items()}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Headless classroom camera scanner")
+    ap.add_argument("cameras", help="JSON file mapping room name to camera index, stream URL or video file")
+    ap.add_argument("--db", default="attendance.db")
+    ap.add_argument("--gallery", default="gallery.npy")
+    ap.add_argument("--workers", type=int, default=2, help="detection threads shared by all rooms")
+    ap.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    ap.add_argument("--stride", type=int, default=DETECT_STRIDE)
+    ap.add_argument("--day", help="use this weekday's schedule instead of today's (e.g. Sunday)")
+    ap.add_argument("--duration", type=float, help="stop after this many seconds")
+    ap.add_argument("--metrics", help="append JSON-lines metrics to this file")
+    args = ap.parse_args(argv)
+
+    db = Database(args.db)
+    if db.schema_version() != SCHEMA_VERSION:
+        with db.transaction() as conn: create_schema(conn); db.set_schema_version(conn, SCHEMA_VERSION)
+    reporter = None
+    if args.metrics:
+        METRICS.enabled = True; reporter = JsonlReporter(METRICS, args.metrics); reporter.start()
+    scanner = RoomScanner(db, load_cameras(args.cameras), args.workers, args.threshold, args.gallery or None, args.day, args.stride)
+    print(f"Scanner: {len(scanner.gallery)} enrolled students, {len(scanner.cameras)} cameras, {args.workers} workers")
+    try: marks = scanner.run(args.duration)
+    finally:
+        if reporter: reporter.stop()
+        db.close()
+    print(f"Scanner stopped, {marks} new marks")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
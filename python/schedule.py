@@ -0,0 +1,27 @@
+# القيم الأولية للجدول وتوزيع المواد، تُنسخ لجداول schedule وsubject_instructors
+# عند إنشاء القاعدة (db.migrate_schedule). بعد ذلك قاعدة البيانات هي المرجع.
+
+# --- توزيع المواد على الدكاترة ---
+SUBJECT_INSTRUCTORS = {
+    "Mathematics": "dr_math",
+    "Physics": "dr_math",
+    "Science": "dr_math",
+    "Chemistry": "dr_math",
+    "Programming": "dr_cs",
+    "Algorithms": "dr_cs",
+    "Networks": "dr_cs",
+    "Databases": "dr_cs",
+    "Graduation Project": "dr_cs",
+    "Seminar": "dr_cs",
+    "English": "dr_math"
+}
+
+# --- الجدول الدراسي ---
+WEEKLY_SCHEDULE = {
+    "Sunday": [("Mathematics", "08:00 AM", "Room 101"), ("Science", "10:00 AM", "Lab A")],
+    "Monday": [("Physics", "09:00 AM", "Lab B"), ("Programming", "11:00 AM", "Computer Lab")],
+    "Tuesday": [("Mathematics", "08:30 AM", "Room 101"), ("Algorithms", "10:30 AM", "Room 202")],
+    "Wednesday": [("Networks", "09:00 AM", "Net Lab"), ("Databases", "12:00 PM", "PC Lab")],
+    "Thursday": [("Graduation Project", "08:00 AM", "Auditorium")]
+}
+